@@ -1,16 +1,27 @@
+import json
+import os
+from functools import lru_cache
+from math import isqrt
 from random import choice
-from itertools import product, repeat
-from functools import partial
+from statistics import NormalDist
 import numpy as np
 import multiprocessing as mp
 import matplotlib.pyplot as plt
 
 plt.style.use('ggplot')
 
-def primesfrom2to(n):
+# integers per sieved segment of primes_in_range, and segments memoized
+SEGMENT = 2**20
+SEGMENT_CACHE = 256
+
+# avg_components results by 'p,deg', see collect_avgs
+CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+	'.avg-components.json')
+
+def _sieve(n):
     # http://stackoverflow.com/questions/2068372/fastest-way-to-list-all-primes-below-n-in-python/3035188#3035188
-    assert(n >= 6)
-    sieve = np.ones(n//3 + (n % 6 == 2), dtype=np.bool)
+    n = max(n, 6)
+    sieve = np.ones(n//3 + (n % 6 == 2), dtype=bool)
     sieve[0] = False
     for i in range(int(n**0.5)//3 + 1):
         if sieve[i]:
@@ -19,44 +30,278 @@ def primesfrom2to(n):
             sieve[(k*k + 4*k - 2*k*(i & 1))//3 :: 2*k] = False
     return np.r_[2, 3, ((3*np.nonzero(sieve)[0] + 1) | 1)]
 
+@lru_cache(maxsize=None)
+def _base_primes(bits):
+	return _sieve(2**bits + 1)
+
+@lru_cache(maxsize=SEGMENT_CACHE)
+def _segment(k):
+	""" Read-only array of the primes in [k*SEGMENT, (k + 1)*SEGMENT), sieved
+	over the odd numbers only by the primes up to its square root. """
+	lo, hi = k*SEGMENT, (k + 1)*SEGMENT
+	sieve = np.ones(SEGMENT//2, dtype=bool)     # sieve[i] is lo + 2*i + 1
+	for q in _base_primes(isqrt(hi).bit_length())[1:].tolist():
+		if q*q >= hi:
+			break
+		start = max(q*q, -(-lo//q)*q)
+		start += q*(start % 2 == 0)
+		sieve[(start - lo)//2::q] = False
+	primes = lo + 1 + 2*np.flatnonzero(sieve)
+	if k == 0:
+		primes = np.r_[2, primes[1:]]
+	primes.flags.writeable = False
+	return primes
+
+def iter_primes(lo=2, hi=None):
+	""" Yields the primes in [lo, hi) (without end if hi is None) as arrays,
+	one segment of SEGMENT integers at a time. The last SEGMENT_CACHE
+	segments are memoized, so repeated and growing queries only sieve new
+	segments. """
+	k = max(lo, 0)//SEGMENT
+	while hi is None or k*SEGMENT < hi:
+		primes = _segment(k)
+		if k*SEGMENT < lo or hi is not None and (k + 1)*SEGMENT > hi:
+			mask = primes >= lo
+			if hi is not None:
+				mask &= primes < hi
+			primes = primes[mask]
+		yield primes
+		k += 1
+
+def primes_in_range(lo, hi):
+	""" Array of the primes p with lo <= p < hi. """
+	return np.concatenate([np.empty(0, dtype=np.int64)] + \
+		list(iter_primes(lo, hi)))
+
+def primesfrom2to(n):
+	return primes_in_range(2, n)
+
 def get_graph(f, p):
 	graph = {}
 	for x in range(p):
 		graph[x] = f(x) % p
 	return graph
 
+def poly_map(coefs, p):
+	""" Array of f(x) % p for all x in range(p), where f is the polynomial
+	sum(c*x**i for i, c in enumerate(coefs)), evaluated by Horner's rule.
+	Given a 2D array of coefficients, one row per polynomial, returns one row
+	of values per polynomial. """
+	coefs = np.asarray(coefs, dtype=np.int64)
+	x = np.arange(p, dtype=np.int64)
+	y = np.zeros(coefs.shape[:-1] + (p,), dtype=np.int64)
+	for i in reversed(range(coefs.shape[-1])):
+		y = (y*x + coefs[..., i, None] % p) % p
+	return y
+
+def as_successors(graph):
+	""" Successor array of a functional graph given as a dict over range(p)
+	(see get_graph) or already as an array. """
+	if isinstance(graph, dict):
+		return np.array([graph[x] for x in range(len(graph))], dtype=np.int64)
+	return np.asarray(graph, dtype=np.int64)
+
+def _peel(succ):
+	""" Peels the nodes off the cycles of succ in layers of in-degree zero.
+	Returns the mask of cycle nodes and the list of layers. """
+	n = len(succ)
+	indeg = np.bincount(succ, minlength=n)
+	on_cycle = np.ones(n, dtype=bool)
+	layers = []
+	layer = np.flatnonzero(indeg == 0)
+	while len(layer):
+		layers.append(layer)
+		on_cycle[layer] = False
+		targets, counts = np.unique(succ[layer], return_counts=True)
+		indeg[targets] -= counts
+		layer = targets[indeg[targets] == 0]
+	return on_cycle, layers
+
+def _cycle_labels(succ, max_path):
+	""" Pointer doubling over paths of at most max_path nodes. Returns the
+	least node on the cycle reached from each node, and the node reached
+	after at least max_path steps, which lies on that cycle. """
+	label, jump = np.arange(len(succ), dtype=succ.dtype), succ.copy()
+	for _ in range(max(1, int(max_path).bit_length())):
+		label = np.minimum(label, label[jump])
+		jump = jump[jump]
+	return label, jump
+
+def components(graph):
+	""" Returns (ncomponents, cycle_lengths, tail_lengths) of the functional
+	graph x -> graph[x]: the number of weakly connected components, the
+	length of the cycle of each component, and for each node the number of
+	steps until it reaches a cycle. Nodes off the cycles are peeled in
+	layers of in-degree zero, and each cycle is labelled by its least node by
+	pointer doubling. """
+	succ = as_successors(graph)
+	on_cycle, layers = _peel(succ)
+	tails = np.zeros(len(succ), dtype=np.int64)
+	for layer in reversed(layers):
+		tails[layer] = tails[succ[layer]] + 1
+	label, _ = _cycle_labels(succ, len(succ))
+	roots, cycle_lengths = np.unique(label[on_cycle], return_counts=True)
+	return len(roots), cycle_lengths, tails
+
+def batch_ncomponents(succs):
+	""" Numbers of components of each row of the 2D array succs, a functional
+	graph over range(p) per row, counted together as one graph of disjoint
+	copies: the image of p steps is exactly the cycle nodes, of which those
+	labelled by themselves are one per cycle. """
+	nrows, p = succs.shape
+	dtype = np.int32 if nrows*p < 2**31 else np.int64
+	flat = (succs + p*np.arange(nrows)[:, None]).ravel().astype(dtype)
+	label, jump = _cycle_labels(flat, p)
+	on_cycle = np.zeros(len(flat), dtype=bool)
+	on_cycle[jump] = True
+	roots = np.flatnonzero(on_cycle & (label == np.arange(len(flat))))
+	return np.bincount(roots//p, minlength=nrows)
+
 def ncomponents(graph):
-	t = 1
-	pool = set(graph.keys())
-	node = None
-	while pool:
-		if node is None:
-			node = pool.pop()	
-		else:
-			node = graph[node]
-			if node not in pool:
-				node = None
-				t += 1
-			else:
-				pool.remove(node)
+	return components(graph)[0]
+
+def ncomponents_reference(graph):
+	""" Brute-force count of the weakly connected components of graph, by
+	search over its undirected edges, to check components() against. """
+	neighbors = {x: set() for x in graph}
+	for x, y in graph.items():
+		neighbors[x].add(y)
+		neighbors[y].add(x)
+	seen, t = set(), 0
+	for x in graph:
+		if x not in seen:
+			t += 1
+			stack = [x]
+			seen.add(x)
+			while stack:
+				for y in neighbors[stack.pop()] - seen:
+					seen.add(y)
+					stack.append(y)
 	return t
 
-def avg_components(p, deg):
-	a = []
-	for coefs in product(*repeat(range(p), deg + 1)):
-		f = lambda x: sum(c*x**i for i, c in enumerate(coefs))
-		a.append(ncomponents(get_graph(f, p)))
-	return np.mean(a)
-
-def collect_avgs(deg, plist, processes=None):
-	if processes is None:
-		processes = max(1, mp.cpu_count() - 1)
-	pool = mp.Pool(processes=processes)
-	avgs = pool.map(partial(avg_components, deg=deg), plist)
-	return avgs
-
-def plot_avgs(deg, max_p):
-	primes = primesfrom2to(max_p)
+def coef_chunks(p, deg, chunk, start=0, stop=None):
+	""" Yields all p**(deg + 1) coefficient tuples of polynomials of degree deg
+	mod p (or those numbered start to stop), as 2D arrays of at most chunk
+	rows. """
+	stop = p**(deg + 1) if stop is None else stop
+	powers = p**np.arange(deg + 1, dtype=np.int64)
+	for first in range(start, stop, chunk):
+		k = np.arange(first, min(first + chunk, stop), dtype=np.int64)
+		yield k[:, None]//powers % p
+
+def chunk_rows(p):
+	return max(1, 2**20//p)
+
+def avg_components(p, deg, samples=None, seed=None):
+	""" Mean number of components of the graphs of all polynomials of degree
+	deg mod p, or the Monte Carlo estimate from samples random ones. """
+	if samples is not None:
+		return sample_components(p, deg, samples, seed=seed)[0]
+	return component_total((p, deg, 0, p**(deg + 1)))[1]/p**(deg + 1)
+
+def component_total(task):
+	""" Returns p and the total number of components of the polynomials
+	numbered start to stop of the task (p, deg, start, stop). """
+	p, deg, start, stop = task
+	total = 0
+	for coefs in coef_chunks(p, deg, chunk_rows(p), start, stop):
+		total += int(batch_ncomponents(poly_map(coefs, p)).sum())
+	return p, total
+
+def sample_components(p, deg, samples, confidence=0.95, seed=None):
+	""" Monte Carlo estimate of avg_components(p, deg) from samples uniformly
+	random coefficient tuples. Returns (mean, low, high), where low and high
+	bound the normal confidence interval of the mean. """
+	random = np.random.RandomState(seed)
+	counts = []
+	for start in range(0, samples, chunk_rows(p)):
+		coefs = random.randint(p, size=(min(chunk_rows(p), samples - start), \
+			deg + 1))
+		counts.append(batch_ncomponents(poly_map(coefs, p)))
+	counts = np.concatenate(counts)
+	z = NormalDist().inv_cdf((1 + confidence)/2)
+	half = z*counts.std(ddof=1)/np.sqrt(samples) if samples > 1 else np.inf
+	return counts.mean(), counts.mean() - half, counts.mean() + half
+
+class Executor(object):
+	""" Reusable pool of processes (all cpus but one by default) computing
+	avg_components. The work of each prime, estimated to cost p**(deg + 1)*p,
+	is split into about tasks_per_process tasks per process in all, handed
+	out costliest first one at a time, so idle processes take over the
+	remaining work of big primes. Use as a context manager, or call close().
+	"""
+	def __init__(self, processes=None, tasks_per_process=8):
+		if processes is None:
+			processes = max(1, mp.cpu_count() - 1)
+		self.processes = processes
+		self.tasks_per_process = tasks_per_process
+		self.pool = mp.Pool(processes=processes)
+
+	def tasks(self, deg, plist):
+		cost = sum(p**(deg + 2) for p in plist)
+		target = max(1, cost//(self.processes*self.tasks_per_process))
+		tasks = []
+		for p in plist:
+			total = p**(deg + 1)
+			rows = max(chunk_rows(p), target//p)
+			tasks += [(p, deg, start, min(start + rows, total)) for start in \
+				range(0, total, rows)]
+		return sorted(tasks, key=lambda t: -(t[3] - t[2])*t[0])
+
+	def avg_components(self, deg, plist):
+		""" Returns {p: avg_components(p, deg)} for the primes in plist. """
+		totals = {int(p): 0 for p in plist}
+		for p, total in self.pool.imap_unordered(component_total, \
+				self.tasks(deg, list(totals))):
+			totals[p] += total
+		return {p: total/p**(deg + 1) for p, total in totals.items()}
+
+	def close(self):
+		self.pool.close()
+		self.pool.join()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		if exc_info[0] is None:
+			self.close()
+		else:
+			self.pool.terminate()
+
+def load_cache(path):
+	if path is None or not os.path.exists(path):
+		return {}
+	with open(path) as f:
+		return json.load(f)
+
+def save_cache(path, cache):
+	tmp = path + '.tmp'
+	with open(tmp, 'w') as f:
+		json.dump(cache, f, indent=1, sort_keys=True)
+	os.replace(tmp, path)
+
+def collect_avgs(deg, plist, processes=None, executor=None, cache=CACHE):
+	""" Returns the list of avg_components(p, deg) for p in plist. Results
+	are kept in the JSON file cache under 'p,deg' (unless cache is None), so
+	only primes not computed before are computed, on executor or else on a
+	new Executor of processes. """
+	results = load_cache(cache)
+	key = lambda p: '{},{}'.format(p, deg)
+	missing = sorted({int(p) for p in plist if key(p) not in results})
+	if missing:
+		if executor is None:
+			with Executor(processes) as executor:
+				avgs = executor.avg_components(deg, missing)
+		else:
+			avgs = executor.avg_components(deg, missing)
+		results.update((key(p), avg) for p, avg in avgs.items())
+		if cache is not None:
+			save_cache(cache, results)
+	return [results[key(p)] for p in plist]
+
+def plot_avgs(deg, max_p, min_p=2):
+	primes = primes_in_range(min_p, max_p)
 	plt.plot(primes, collect_avgs(deg, primes), '-o')
 	plt.xticks(primes, rotation=30, ha='right')
 	plt.title('Mean components, degree: {}'.format(deg))
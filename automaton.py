@@ -1,22 +1,41 @@
-import matplotlib.pyplot as plt
+import re
 import numpy as np
+from functools import lru_cache, reduce
+from math import isqrt
 from itertools import islice, chain, repeat, zip_longest, product
-from matplotlib.animation import FuncAnimation
+from queue import Queue, Empty, Full
+from threading import Event, Thread
+from profiling import stage, timer
 
+@lru_cache(maxsize=1024)
 def find_factorization(x, alpha=1, beta=1):
     """Return the tuple (n, m) that best factorizes x <= n*m such that x - n*m 
     is small and n is close to m. The weights of these two goals are 
-    respectively alpha, beta."""
+    respectively alpha, beta. For nonnegative weights the best m for each n
+    is the least one allowed, max(n, ceil(x/n)), and no n beyond ceil(sqrt(x))
+    does better, so only O(sqrt(x)) candidates are tried, in the order (and
+    with the tie-breaking) of the full search over n <= m <= x."""
     loss = lambda x, n, m: alpha*abs(x - n*m) + beta*abs(n - m) 
-    def solve(x):
-        (n_min, m_min), loss_min = (None, None), float('inf')
-        for n in range(1, x + 1):
-            for m in range(n, x + 1):
-                fval = loss(x, n, m)
-                if fval < loss_min and x <= n*m:
-                    (n_min, m_min), loss_min = (n, m), fval
-        return (n_min, m_min)
-    return solve(x)
+    (n_min, m_min), loss_min = (None, None), float('inf')
+    if alpha < 0 or beta < 0:
+        candidates = ((n, m) for n in range(1, x + 1) for m in range(n, x + 1))
+    else:
+        root = isqrt(x - 1) + 1 if x > 0 else 0     # ceil(sqrt(x))
+        candidates = ((n, max(n, -(-x//n))) for n in range(1, root + 1))
+    for n, m in candidates:
+        fval = loss(x, n, m)
+        if fval < loss_min and x <= n*m:
+            (n_min, m_min), loss_min = (n, m), fval
+    return (n_min, m_min)
+
+def paginate(x, per_page):
+    """Split x items into pages of at most per_page items, returning the
+    (start, stop, (n, m)) of each, with (n, m) its find_factorization()."""
+    pages = []
+    for start in range(0, x, per_page):
+        stop = min(x, start + per_page)
+        pages.append((start, stop, find_factorization(stop - start)))
+    return pages
 
 def neighborhoods(it, n, pad=0):
     """Given a 1D iterable it, and neighborhood width n, yields n-gram tuples 
@@ -25,6 +44,24 @@ def neighborhoods(it, n, pad=0):
     for i in range(len(it)):
         yield padded_it[i:i + n]
 
+@stage('ca.neighborhoods', items=len)
+def neighborhood_codes(state, size, base, pad=0, wrap=False):
+    """Return an array holding, for each cell of the 1D array state, the base
+    encoding of its size-wide neighborhood (leftmost cell most significant).
+    The neighborhoods match those of neighborhoods(), padded with pad, or
+    wrapping around the ends if wrap."""
+    state = np.asarray(state).astype(np.intp)
+    if wrap:
+        padded = np.take(state, np.arange(-(size//2), len(state) + size//2), \
+            mode='wrap')
+    else:
+        edge = np.full(size//2, pad, dtype=np.intp)
+        padded = np.concatenate((edge, state, edge))
+    codes = np.zeros(len(state), dtype=np.intp)
+    for j in range(size):
+        codes = codes*base + padded[j:j + len(state)]
+    return codes
+
 def binary_digits(n, width):
     """Return n in binary, padded in the front with 0s such that the binary 
     representation has width digits."""
@@ -39,56 +76,249 @@ def dec2base(n, base, width=0):
     digits.extend(repeat(0, width - len(digits)))
     return tuple(reversed(digits))
 
+@lru_cache(maxsize=4096)
+@stage('ca.rule_table', items=len)
+def rule_table(index, base, size):
+    """Return the targets of the rule index (see Rule) for the base**size
+    encoded neighborhoods, as a read-only array. Recently built tables are
+    cached."""
+    assert(index >= 0)
+    per = max(1, int(62//np.log2(base)))      # base digits per int64 chunk
+    chunks = []
+    while index:
+        index, chunk = divmod(index, base**per)
+        chunks.append(chunk)
+    powers = np.array([base**i for i in range(per)], dtype=np.int64)
+    digits = (np.array(chunks, dtype=np.int64)[:, None]//powers % base)\
+        .ravel()
+    assert(not digits[base**size:].any())    # i.e. index < base**(base**size)
+    table = np.zeros(base**size, dtype=np.intp)
+    table[:min(len(digits), len(table))] = digits[:len(table)]
+    table.flags.writeable = False
+    return table
+
 class Rule(object):
     """Rule object is created from an index rule (which can be read in base 2) 
     from a lexicographic ordering of all possible rules with size look 
     around. E.g. if size == 2, and index == 0 then the rule would be 
     (0, 0): 0, (0, 1): 0, (1, 0): 0, (1, 1): 0. Rule objects support key 
-    lookups."""
+    lookups. The dense array table maps each neighborhood, read as a number in
+    base, to its target."""
+    __slots__ = ('index', 'base', 'size', 'table')
+
     def __init__(self, index, base=2, size=3):
         self.size = size
         self.index = index
         self.base = base
         if index == 'random':
-            self.dict = {dec2base(i, base, width=size): np.random.randint(base) \
-                for i in range(base**size)}
-            self.index = sum(v*base**i for i, (k, v) in \
-                enumerate(sorted(self.dict.items())))
+            self.table = np.random.randint(base, size=base**size)
+            self.table.flags.writeable = False
+            self.index = 0
+            for t in reversed(self.table.tolist()):
+                self.index = self.index*base + t
         else:
-            assert(index < base**(base**size))
-            targets = dec2base(index, base, width=base**size)
-            self.dict = {dec2base(i, base, width=size): t for i, t in \
-                enumerate(reversed(targets))}
-        
+            self.table = rule_table(index, base, size)
+
+    @property
+    def dict(self):
+        """The rule as a dictionary from neighborhood tuples to targets."""
+        return {dec2base(i, self.base, width=self.size): t for i, t in \
+            enumerate(self.table.tolist())}
+
     def __repr__(self):
         return '{' + ',\n'.join('{}: {}'.format(k, v) for k, v in \
             sorted(self.dict.items())) + '}'
 
     def __getitem__(self, key):
-        return self.dict[tuple(np.reshape(key, -1))]    # to allow ndarray keys
+        code = 0
+        for c in np.reshape(key, -1).tolist():     # to allow ndarray keys
+            code = code*self.base + int(c)
+        return self.table[code].item()
+
+class TotalisticRule(object):
+    """Totalistic rule, whose target only depends on the sum of the size
+    cells of a neighborhood. The digits of index in base, least significant
+    first, are the targets of the sums 0, 1, ..., (base - 1)*size (Wolfram's
+    numbering, e.g. TotalisticRule(1599, base=3) is code 1599)."""
+    def __init__(self, index, base=2, size=3):
+        self.size = size
+        self.index = index
+        self.base = base
+        nsums = (base - 1)*size + 1
+        if index == 'random':
+            self.targets = np.random.randint(base, size=nsums)
+            self.index = sum(int(t)*base**i for i, t in enumerate(self.targets))
+        else:
+            assert(index < base**nsums)
+            self.targets = np.array(dec2base(index, base, width=nsums)[::-1], \
+                dtype=np.intp)
+        self._table = None
+
+    def __repr__(self):
+        return '{' + ',\n'.join('sum {}: {}'.format(k, v) for k, v in \
+            enumerate(self.targets)) + '}'
 
-# todo: let curr_state be nD matrix
-def next_state(curr_state, rule):
-    new_state = []
-    for pattern in neighborhoods(curr_state, rule.size):
-        new_state.append(rule[pattern])
-    return new_state
+    def __getitem__(self, key):
+        return self.targets[int(np.sum(key))]
 
-def plot_rules(init, rules, niter, cmap='Greys', view=0):
+    @property
+    def table(self):
+        """Dense lookup table over encoded neighborhoods, as for Rule."""
+        if self._table is None:
+            codes = np.arange(self.base**self.size)
+            powers = self.base**np.arange(self.size)
+            totals = (codes[:, None]//powers % self.base).sum(axis=1)
+            self._table = self.from_sums(totals, None)
+        return self._table
+
+    def from_sums(self, total, center):
+        """Targets given the neighborhood sums total and center cells."""
+        return self.targets[total]
+
+class OuterTotalisticRule(object):
+    """Binary outer totalistic rule in B/S notation, e.g. 'B3/S23' for
+    Conway's life: a dead cell is born when the number of live cells among
+    its size - 1 neighbors is listed after B, and a live cell survives when
+    it is listed after S. The default size is the 3x3 (Moore) box."""
+    def __init__(self, notation, size=9):
+        match = re.match(r'^B(\d*)/S(\d*)$', notation.strip().upper())
+        if match is None:
+            raise ValueError('Expected B/S notation, e.g. B3/S23, got {!r}.'\
+                .format(notation))
+        self.size = size
+        self.base = 2
+        self.birth, self.survival = (sorted(set(int(c) for c in g)) \
+            for g in match.groups())
+        assert(all(n < size for n in self.birth + self.survival))
+        self.index = 'B{}/S{}'.format(*(''.join(map(str, g)) for g in \
+            (self.birth, self.survival)))
+        self.born = np.isin(np.arange(size), self.birth).astype(np.intp)
+        self.survives = np.isin(np.arange(size), self.survival).astype(np.intp)
+        self._table = None
+
+    def __repr__(self):
+        return self.index
+
+    def __getitem__(self, key):
+        key = np.reshape(key, -1)
+        return self.from_sums(int(np.sum(key)), key[self.size//2])
+
+    @property
+    def table(self):
+        """Dense lookup table over encoded neighborhoods, as for Rule."""
+        if self._table is None:
+            codes = np.arange(2**self.size)
+            cells = codes[:, None] >> np.arange(self.size) & 1
+            self._table = self.from_sums(cells.sum(axis=1), \
+                cells[:, self.size//2])
+        return self._table
+
+    def from_sums(self, total, center):
+        """Targets given the neighborhood sums total and center cells."""
+        return np.where(center == 1, self.survives[total - center], \
+            self.born[total - center])
+
+@stage('ca.step', items=len)
+def next_state(curr_state, rule, pad=0, wrap=False):
+    """Apply rule to every cell of the 1D curr_state at once, by looking up
+    the encoded neighborhoods in rule.table."""
+    return rule.table[neighborhood_codes(curr_state, rule.size, rule.base, \
+        pad=pad, wrap=wrap)]
+
+def generations(init, rule, niter=None, pad=0, wrap=False):
+    """Yield init followed by the next niter states of rule (forever if niter
+    is None) as uint8 arrays, one generation at a time."""
+    state = np.asarray(init, dtype=np.uint8)
+    yield state
+    for _ in (repeat(None) if niter is None else range(niter)):
+        state = next_state(state, rule, pad=pad, wrap=wrap).astype(np.uint8)
+        yield state
+
+def pack_bits(cells):
+    """Pack the binary cells along the last axis into little-endian uint64
+    words, where cell i is bit i % 64 of word i // 64."""
+    cells = np.asarray(cells, dtype=np.uint8)
+    nwords = -(-cells.shape[-1]//64)
+    padding = [(0, 0)]*(cells.ndim - 1) + [(0, nwords*64 - cells.shape[-1])]
+    packed = np.packbits(np.pad(cells, padding), axis=-1, bitorder='little')
+    return packed.view('<u8').astype(np.uint64)
+
+def unpack_bits(words, width):
+    """Inverse of pack_bits, returning the first width cells as uint8."""
+    octets = np.ascontiguousarray(words, dtype='<u8').view(np.uint8)
+    return np.unpackbits(octets, axis=-1, bitorder='little')[..., :width]
+
+def evolve_packed(init, indices, niter, wrap=False):
+    """Evolve init (or each row of the 2D init under its rule) under every
+    elementary (base 2, size 3) rule index in indices simultaneously, for
+    niter iterations, on a ring if wrap. The
+    states of all rules are kept bit-packed in uint64 words (see pack_bits),
+    and each step ORs together the minterms of the left/center/right
+    neighbor words selected by each rule's table, as a tree of multiplexers
+    on the right, center and left neighbors. Returns the packed history, of
+    shape (niter + 1, len(indices), words per state)."""
+    width = np.shape(init)[-1]
+    one, top = np.uint64(1), np.uint64(63)
+    last = np.uint64((width - 1) % 64)
+    mask = pack_bits(np.ones(width))
+    # select[k] is all ones for the rules mapping neighborhood k to 1
+    bits = (np.asarray(indices, dtype=np.uint64)[:, None] >> \
+        np.arange(8, dtype=np.uint64)) & one
+    select = (np.uint64(0) - bits).T[:, :, None]
+    # neighborhood k = 4*l + 2*c + r maps to select[k], and x ^ (y & (x ^ z))
+    # picks z where y is set and x elsewhere
+    low, flip = select[0::2], select[0::2] ^ select[1::2]
+    state = np.broadcast_to(pack_bits(init), (len(indices), len(mask)))
+    history = np.empty((niter + 1,) + state.shape, dtype=np.uint64)
+    history[0] = state
+    for i in range(niter):
+        left, right = state << one, state >> one
+        left[:, 1:] |= state[:, :-1] >> top
+        right[:, :-1] |= state[:, 1:] << top
+        if wrap:
+            left[:, 0] |= (state[:, -1] >> last) & one
+            right[:, -1] |= (state[:, 0] & one) << last
+        by_r = low ^ (right & flip)             # indexed by 2*l + c
+        by_c = by_r[0::2] ^ (state & (by_r[0::2] ^ by_r[1::2]))
+        state = by_c[0] ^ (left & (by_c[0] ^ by_c[1]))
+        state &= mask
+        history[i + 1] = state
+    return history
+
+@stage('ca.elementary', items=lambda cells: cells.size)
+def evolve_elementary(init, indices, niter, view=0, wrap=False):
+    """Evolve init under every elementary rule index in indices
+    simultaneously, for niter iterations, bit-packed as in evolve_packed.
+    Returns a uint8 array of shape (len(indices), niter + 1 - view,
+    len(init)) that matches repeated next_state calls."""
+    history = evolve_packed(init, indices, niter, wrap=wrap)
+    return unpack_bits(history[view:].transpose(1, 0, 2), len(init))
+
+def plot_rules(init, rules, niter, cmap='Greys', view=0, per_page=64):
     """For each rule in rules (an iterable of Rule objects) plot the subplots
-    of each rule performed on init for niter iterations."""
-    sub_x, sub_y = find_factorization(len(rules))
-    fig, axes = plt.subplots(sub_x, sub_y)
-    for r, ax in zip_longest(rules, np.reshape(axes, -1)):
-        ax.axis('off')
-        if r is not None:
-            matrix = np.zeros((niter + 1, len(init)))
-            matrix[0, :] = init
-            for i in range(niter):
-                matrix[i + 1, :] = next_state(matrix[i, :], r)
-            ax.imshow(matrix[view:, :], interpolation='nearest', cmap=cmap)
-            ax.set_title('Rule: {}'.format(r.index))
-    plt.show()
+    of each rule performed on init for niter iterations. Rules are shown
+    per_page at a time, one figure after the other, and only the rules of
+    the current figure are simulated."""
+    import matplotlib.pyplot as plt
+    rules = list(rules)
+    for start, stop, (sub_x, sub_y) in paginate(len(rules), per_page):
+        page = rules[start:stop]
+        fig, axes = plt.subplots(sub_x, sub_y)
+        if all(r.base == 2 and r.size == 3 for r in page):
+            indices = [int(np.dot(r.table, 2**np.arange(8))) for r in page]
+            matrices = evolve_elementary(init, indices, niter, view=view)
+        else:
+            matrices = [np.array(list(islice(generations(init, r), view, \
+                niter + 1))) for r in page]
+        with timer('ca.render', items=len(page)):
+            for r, matrix, ax in zip_longest(page, matrices, \
+                    np.reshape(axes, -1)):
+                ax.axis('off')
+                if r is not None:
+                    ax.imshow(matrix, interpolation='nearest', cmap=cmap)
+                    ax.set_title('Rule: {}'.format(r.index))
+        plt.show()
+        plt.close(fig)
 
 def wrapped_ball(A, x, reach):
     """Return the neighborhood of an nD coordinate x within an nD matrix A, 
@@ -113,30 +343,263 @@ def nball(A, x, reach=1, wrap=True, pad=0):
     shape = tuple(2*reach + 1 for _ in range(len(A.shape)))
     return np.fromfunction(np.vectorize(func), shape=shape, dtype=A.dtype)
 
-def animate_rules(init, rules, niter):
-    """Similar to plot_rules(), animates subpots of each rule in rules."""
-    sub_x, sub_y = find_factorization(len(rules))
-    fig, axes = plt.subplots(sub_x, sub_y)
-    matrices = [np.zeros((niter + 1, len(init))) for _ in range(len(rules))]
-    for m in matrices:      # make it such that init can be a list of inits
-        m[0, :] = init
-    kwargs = {'interpolation': 'nearest', 'cmap': 'Greys'}
-    ims = [ax.imshow(m, **kwargs) for m, ax in \
-        zip(matrices, np.reshape(axes, -1))]
+def window_codes(padded, shape, reach, base):
+    """Return the base encoding of every (2*reach + 1)**n box in the already
+    padded nD array, one per cell of an array of the given shape. The box is
+    read in the same order as wrapped_ball() and nball(). Any leading axes of
+    padded beyond the n of shape are kept as batch axes."""
+    codes = 0
+    for offset in product(range(2*reach + 1), repeat=len(shape)):
+        window = tuple(slice(o, o + n) for o, n in zip(offset, shape))
+        codes = codes*base + padded[(Ellipsis,) + window]
+    return codes
+
+def window_sums(padded, shape, reach):
+    """Like window_codes(), but return the sums of the boxes and their center
+    cells."""
+    total = 0
+    for offset in product(range(2*reach + 1), repeat=len(shape)):
+        window = tuple(slice(o, o + n) for o, n in zip(offset, shape))
+        total = total + padded[(Ellipsis,) + window]
+    center = tuple(slice(reach, reach + n) for n in shape)
+    return total, padded[(Ellipsis,) + center]
+
+def apply_rule(padded, shape, reach, rule):
+    """Targets of rule for every box of the padded array (see window_codes),
+    going through the sums for (outer) totalistic rules."""
+    if hasattr(rule, 'from_sums'):
+        return rule.from_sums(*window_sums(padded, shape, reach))
+    return rule.table[window_codes(padded, shape, reach, rule.base)]
+
+def pad_state(A, reach, wrap=True, pad=0):
+    """Pad each axis of A with reach cells, wrapping around or filled with
+    pad."""
+    A = np.asarray(A).astype(np.intp)
+    if wrap:
+        return np.pad(A, reach, mode='wrap')
+    return np.pad(A, reach, mode='constant', constant_values=pad)
+
+@stage('ca.step_nD', items=lambda cells: cells.size)
+def next_state_nD(A, rule, reach=1, wrap=True, pad=0):
+    """Apply rule to every cell of the nD array A at once, where each cell
+    sees the box of radius reach around it (rule.size == (2*reach + 1)**n).
+    All cells are updated from the previous generation."""
+    assert(rule.size == (2*reach + 1)**np.ndim(A))
+    padded = pad_state(A, reach, wrap=wrap, pad=pad)
+    return apply_rule(padded, np.shape(A), reach, rule)
+
+class SparseAutomaton(object):
+    """Steps an nD automaton (see next_state_nD) on a grid cut into tiles of
+    tile cells per axis, only re-evaluating the tiles next to those that
+    changed in the last generation: a cell whose neighborhood did not change
+    keeps its state. Suited to large, mostly quiescent grids."""
+    def __init__(self, init, rule, reach=1, wrap=True, pad=0, tile=16):
+        assert(rule.size == (2*reach + 1)**np.ndim(init))
+        assert(reach <= tile)
+        self.state = np.array(init, dtype=np.intp)
+        self.rule = rule
+        self.reach = reach
+        self.wrap = wrap
+        self.pad = pad
+        self.tile = tile
+        self.generation = 0
+        self.evaluated = 0      # number of cells evaluated by the last step
+        self.dirty = np.ones([-(-n//tile) for n in self.state.shape], \
+            dtype=bool)
+        # with wrapping, a short last tile may not cover the reach of tile 0
+        self.spread = 1 + any(wrap and 0 < n % tile < reach for n in \
+            self.state.shape)
+
+    def _active(self):
+        """Tiles within self.spread tiles of a dirty one."""
+        active = self.dirty.copy()
+        for _ in range(self.spread):
+            for axis in range(active.ndim):
+                if self.wrap:
+                    active |= np.roll(active, 1, axis) | \
+                        np.roll(active, -1, axis)
+                else:
+                    grown = active.copy()
+                    lo = [slice(None)]*active.ndim
+                    hi = [slice(None)]*active.ndim
+                    lo[axis], hi[axis] = slice(None, -1), slice(1, None)
+                    grown[tuple(lo)] |= active[tuple(hi)]
+                    grown[tuple(hi)] |= active[tuple(lo)]
+                    active = grown
+        return active
+
+    @staticmethod
+    def _grids(indices):
+        """Reshape per tile index arrays, shape (ntiles, len), so that they
+        broadcast to their outer product, shape (ntiles, len, ..., len)."""
+        ndim = len(indices)
+        return [idx.reshape((idx.shape[0],) + tuple(idx.shape[1] if a == b \
+            else 1 for b in range(ndim))) for a, idx in enumerate(indices)]
+
+    def _gather(self, indices):
+        """Return self.state at the outer product of the per tile index
+        arrays, wrapped or padded out of bounds."""
+        grids, shape = self._grids(indices), self.state.shape
+        if self.wrap:
+            return self.state[tuple(g % n for g, n in zip(grids, shape))]
+        inside = reduce(np.logical_and, ((g >= 0) & (g < n) for g, n in \
+            zip(grids, shape)))
+        values = self.state[tuple(np.clip(g, 0, n - 1) for g, n in \
+            zip(grids, shape))]
+        return np.where(inside, values, self.pad)
+
+    @stage('ca.sparse_step')
+    def step(self):
+        """Advance one generation and return the new state."""
+        tiles = np.argwhere(self._active())
+        t, r, ndim = self.tile, self.reach, self.state.ndim
+        self.evaluated = 0
+        if len(tiles):
+            cells = [tiles[:, [a]]*t + np.arange(t) for a in range(ndim)]
+            halos = [tiles[:, [a]]*t + np.arange(-r, t + r) for a in \
+                range(ndim)]
+            new = apply_rule(self._gather(halos), (t,)*ndim, r, self.rule)
+            old = self._gather(cells)
+            grids = np.broadcast_arrays(*self._grids(cells))
+            valid = reduce(np.logical_and, (g < n for g, n in \
+                zip(grids, self.state.shape)))
+            changed = ((new != old) & valid).reshape(len(tiles), -1).any(1)
+            self.state[tuple(g[valid] for g in grids)] = new[valid]
+            self.dirty[tuple(tiles.T)] = changed
+            self.evaluated = int(valid.sum())
+        self.generation += 1
+        return self.state
+
+class Prefetcher(object):
+    """Iterate over the items of iterable as computed ahead by a producer
+    thread into a bounded buffer of depth items, so that computing the next
+    generations overlaps drawing the current ones. Exceptions raised by the
+    producer are raised again when reached. close() stops the producer, after
+    which iteration ends once the buffer is drained instead of waiting."""
+    _done = object()
+
+    def __init__(self, iterable, depth=16):
+        self.buffer = Queue(maxsize=depth)
+        self.stopped = Event()
+        self.thread = Thread(target=self._produce, args=(iter(iterable),), \
+            daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.buffer.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _produce(self, it):
+        try:
+            for item in it:
+                if not self._put(item):
+                    return
+        except Exception as e:
+            self._put(e)
+        self._put(self._done)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            try:
+                item = self.buffer.get(timeout=0.1)
+                break
+            except Empty:
+                if self.stopped.is_set():
+                    raise StopIteration
+        if item is self._done:
+            self.buffer.put(item)
+            raise StopIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def close(self):
+        self.stopped.set()
+
+def _animation_figure(n, save):
+    """Figure and flat axes for n subplots, drawn off screen when saving."""
+    sub_x, sub_y = find_factorization(n)
+    if save is None:
+        import matplotlib.pyplot as plt
+        fig, axes = plt.subplots(sub_x, sub_y)
+    else:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        axes = fig.subplots(sub_x, sub_y)
+    axes = np.reshape(axes, -1)
+    for ax in axes:
+        ax.axis('off')
+    return fig, axes
+
+def _run_animation(fig, update, init_func, frames, interval, save, fps, \
+        writer, producer):
+    """Show the animation blitting the artists update returns, or write it
+    to the file save with writer (pillow for .gif, ffmpeg otherwise). The
+    producer is closed after the last frame or when the figure is closed,
+    since show() may return at once (interactive mode, notebooks)."""
+    from matplotlib.animation import FuncAnimation
+    def frame(i):
+        try:
+            return update(i)
+        finally:
+            if i == frames - 1:
+                producer.close()
+    fig.canvas.mpl_connect('close_event', lambda event: producer.close())
+    ani = FuncAnimation(fig, frame, frames=frames, init_func=init_func, \
+        interval=interval, blit=True, repeat=False)
+    if save is None:
+        import matplotlib.pyplot as plt
+        plt.show()
+    else:
+        if writer is None:
+            writer = 'pillow' if save.lower().endswith('.gif') else 'ffmpeg'
+        try:
+            ani.save(save, writer=writer, fps=fps or 1000/interval)
+        finally:
+            producer.close()
+    return ani
+
+def animate_rules(init, rules, niter, save=None, fps=None, writer=None, \
+        buffer=64):
+    """Similar to plot_rules(), animates subpots of each rule in rules. The
+    generations are computed ahead by a Prefetcher holding up to buffer
+    generations, and each frame writes one new row into the images' arrays
+    in place and redraws only the images. If save is a file name, e.g. 'rules.gif' or 'rules.mp4', the
+    animation is written there at fps frames per second instead of shown."""
+    fig, axes = _animation_figure(len(rules), save)
+    matrix = np.zeros((niter + 1, len(init)), dtype=np.uint8)
+    matrix[0, :] = init     # make it such that init can be a list of inits
+    kwargs = {'interpolation': 'nearest', 'cmap': 'Greys', 'vmin': 0}
+    ims = [ax.imshow(matrix, vmax=r.base - 1, **kwargs) for r, ax in \
+        zip(rules, axes)]
+    for r, ax in zip(rules, axes):
+        ax.set_title('Rule: {}'.format(r.index))
+    rows = Prefetcher(islice(zip(*[generations(init, r, niter) for r in \
+        rules]), 1, None), depth=buffer)
     def update(i):
-        for r, m, im, ax in \
-                zip_longest(rules, matrices, ims, np.reshape(axes, -1)):
-            ax.axis('off')
-            if r is not None:
-                m[i + 1, :] = next_state(m[i, :], r)
-                im.set_data(m)
-                ax.set_title('Rule: {}'.format(r.index))
-    ani = FuncAnimation(fig, update, frames=niter, interval=10)
-    plt.show()
+        for im, row in zip(ims, next(rows)):
+            # imshow keeps its own copy of the matrix, whose new row is
+            # written in place instead of passing the whole matrix again
+            im.get_array()[i + 1, :] = row
+            im.changed()
+        return ims
+    return _run_animation(fig, update, lambda: ims, niter, 10, save, fps, \
+        writer, rows)
 
 """todo: allow rule to be  list of rules, and subdivide areas of axes
 to be the different rules"""
-def plot_rule_nD(init, rule, niter):
+def plot_rule_nD(init, rule, niter, reach=1, wrap=True, pad=0):
+    import matplotlib.pyplot as plt
     sub_x, sub_y = find_factorization(niter + 1)
     fig, axes = plt.subplots(sub_x, sub_y)
     kwargs = {'interpolation': 'nearest', 'cmap': 'Greys'}     
@@ -145,30 +608,34 @@ def plot_rule_nD(init, rule, niter):
         ax.axis('off')
         if i <= niter + 1:
             ax.imshow(matrix.copy(), **kwargs)
-            for index, _ in np.ndenumerate(matrix):
-                ball = wrapped_ball(matrix, index, reach=1)
-                matrix[index] = rule[tuple(ball)]
+            matrix = next_state_nD(matrix, rule, reach=reach, wrap=wrap, \
+                pad=pad)
     plt.show()
 
-def animate_rules_nD(init, rules, niter, wrap=True):
-    sub_x, sub_y = find_factorization(len(rules))
-    fig, axes = plt.subplots(sub_x, sub_y)
-    matrices = [init.copy() for _ in range(len(rules))]
-    kwargs = {'interpolation': 'nearest', 'cmap': 'Greys'}
-    ims = [ax.imshow(m, **kwargs) for m, ax in \
-        zip(matrices, np.reshape(axes, -1))]
+def animate_rules_nD(init, rules, niter, reach=1, wrap=True, pad=0, \
+        save=None, fps=None, writer=None, buffer=16):
+    """Animates the 2D init under each rule in rules side by side, with the
+    generations computed ahead as in animate_rules(), which also describes
+    save, fps and writer."""
+    fig, axes = _animation_figure(len(rules), save)
+    kwargs = {'interpolation': 'nearest', 'cmap': 'Greys', 'vmin': 0}
+    ims = [ax.imshow(init, vmax=r.base - 1, **kwargs) for r, ax in \
+        zip(rules, axes)]
+    for r, ax in zip(rules, axes):
+        ax.set_title('Rule: {}'.format(r.index))
+    def states():
+        matrices = [np.asarray(init) for _ in rules]
+        while True:
+            yield matrices
+            matrices = [next_state_nD(m, r, reach=reach, wrap=wrap, pad=pad) \
+                for m, r in zip(matrices, rules)]
+    frames = Prefetcher(states(), depth=buffer)
     def update(i):
-        for r, m, im, ax in \
-                zip_longest(rules, matrices, ims, np.reshape(axes, -1)):
-            ax.axis('off')
-            if r is not None:
-                im.set_data(m)
-                for index, _ in np.ndenumerate(m):
-                    ball = nball(m, index, reach=1, wrap=wrap)
-                    m[index] = r[ball]
-                ax.set_title('Rule: {}'.format(r.index))
-    ani = FuncAnimation(fig, update, frames=niter, interval=200, repeat=False)
-    plt.show()
+        for im, m in zip(ims, next(frames)):
+            im.set_data(m)
+        return ims
+    return _run_animation(fig, update, lambda: ims, niter, 200, save, fps, \
+        writer, frames)
 
 if __name__ == '__main__':
     pass
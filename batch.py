@@ -0,0 +1,174 @@
+""" Batch rendering of l-system galleries: jobs, each a system, niter, cmap
+and pensize (plus size, dpi and seed), are rendered headless to image files
+across a pool of processes. Outputs whose inputs did not change since they
+were last rendered are skipped.
+"""
+
+import hashlib
+import importlib.util
+import json
+import multiprocessing as mp
+import os
+import time
+from itertools import product
+
+MANIFEST = '.batch-manifest.json'
+DEFAULTS = {'niter': None, 'cmap': None, 'pensize': 3, 'size': 4, 'dpi': 100, \
+	'seed': None, 'format': 'png'}
+
+def parse_ranges(specs):
+	""" Returns the integers given by strings such as '100', '102' and
+	'120-130', where ranges exclude their end as in runner.py -c.
+	"""
+	values = []
+	for spec in specs:
+		bounds = [int(c) for c in str(spec).split('-')]
+		values.extend(range(bounds[0], bounds[1]) if len(bounds) == 2 else \
+			bounds)
+	return values
+
+def expand_jobs(spec):
+	""" Returns the list of jobs of a spec: a job dictionary, or a list of
+	them, where any list value (or range string for niter and pensize, e.g.
+	'3-6') is expanded into one job per value.
+	"""
+	if isinstance(spec, list):
+		return [job for s in spec for job in expand_jobs(s)]
+	options = []
+	for key, value in sorted(spec.items()):
+		if key in ('niter', 'pensize') and isinstance(value, str):
+			value = parse_ranges(value.split())
+		options.append([(key, v) for v in (value if isinstance(value, list) \
+			else [value])])
+	return [dict(DEFAULTS, **dict(choice)) for choice in product(*options)]
+
+def load_jobs(path):
+	""" Jobs of a JSON spec file, see expand_jobs. """
+	with open(path) as f:
+		return expand_jobs(json.load(f))
+
+def lookup_cmap(name):
+	""" Matplotlib colormap of a colorbrewer sequential cmap name, e.g.
+	'YlOrRd_9'.
+	"""
+	from palettable.colorbrewer import sequential
+	palette = getattr(sequential, name, None)
+	if palette is None or not hasattr(palette, 'mpl_colormap'):
+		raise ValueError('Unknown colorbrewer sequential cmap {!r}.'.format(name))
+	return palette.mpl_colormap
+
+def output_name(job):
+	""" File name of a job's image unless the job gives an output. """
+	if job.get('output'):
+		return job['output']
+	parts = [os.path.splitext(os.path.basename(job['system']))[0]]
+	parts += ['n{}'.format(job['niter'])] if job['niter'] is not None else []
+	parts += [job['cmap']] if job['cmap'] else []
+	parts += ['p{}'.format(job['pensize'])]
+	parts += ['s{}'.format(job['seed'])] if job['seed'] is not None else []
+	return '-'.join(parts) + '.' + job['format']
+
+def _source_files(job):
+	here = os.path.dirname(os.path.abspath(__file__))
+	files = [os.path.join(here, f) for f in ('lsystem.py', 'geometry.py')]
+	if job['system'].endswith('.py'):
+		files.append(job['system'])
+	return files
+
+def job_hash(job):
+	""" Content hash of everything a job's image depends on: its parameters
+	and the source of the l-system and geometry code (and of its system file).
+	"""
+	digest = hashlib.sha256(json.dumps(job, sort_keys=True).encode())
+	for path in _source_files(job):
+		with open(path, 'rb') as f:
+			digest.update(f.read())
+	return digest.hexdigest()
+
+def load_system(path):
+	""" Executes the system file at path as a new module, which is not cached,
+	so that its module level derivation reflects the current random state.
+	"""
+	spec = importlib.util.spec_from_file_location('_batch_system', \
+		os.path.abspath(path))
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+def render_job(job, outdir):
+	""" Renders one job to outdir and returns its output path. """
+	import numpy as np
+	from lsystem import SYSTEMS, Derivation, Drawer
+	if job['seed'] is not None:
+		np.random.seed(job['seed'])
+	cmap = lookup_cmap(job['cmap']) if job['cmap'] else None
+	kwargs = {'cmap': cmap, 'pensize': job['pensize']}
+	if job['system'].endswith('.py'):
+		module = load_system(job['system'])
+		seq, draw_rules = module.seq, module.draw_rules
+		kwargs.update(getattr(module, 'kwargs', {}))
+	else:
+		system = SYSTEMS[job['system']]
+		niter = system['niter'] if job['niter'] is None else job['niter']
+		seq = Derivation(system['rules'], niter=niter, init=system['init'])
+		draw_rules = system['draw_rules']
+		kwargs['init_angle'] = system['init_angle']
+	path = os.path.join(outdir, output_name(job))
+	Drawer(seq, draw_rules, **kwargs).save(path, size=job['size'], \
+		dpi=job['dpi'])
+	return path
+
+def _run(args):
+	job, outdir = args
+	start = time.perf_counter()
+	try:
+		render_job(job, outdir)
+		status = 'rendered'
+	except Exception as e:
+		status = 'failed: {}'.format(e)
+	return job, status, time.perf_counter() - start
+
+def run_batch(jobs, outdir, processes=None, force=False):
+	""" Renders jobs to outdir across a pool of processes (all cpus but one by
+	default), skipping jobs whose output exists with an unchanged job_hash
+	unless force. Returns a list of (job, status, seconds).
+	"""
+	os.makedirs(outdir, exist_ok=True)
+	manifest_path = os.path.join(outdir, MANIFEST)
+	manifest = {}
+	if os.path.exists(manifest_path):
+		with open(manifest_path) as f:
+			manifest = json.load(f)
+	results, todo = [], []
+	for job in jobs:
+		name, digest = output_name(job), job_hash(job)
+		if not force and manifest.get(name) == digest and \
+				os.path.exists(os.path.join(outdir, name)):
+			results.append((job, 'cached', 0.0))
+		else:
+			todo.append((job, outdir))
+	if processes is None:
+		processes = max(1, mp.cpu_count() - 1)
+	if todo:
+		with mp.Pool(processes=min(processes, len(todo))) as pool:
+			for job, status, seconds in pool.imap_unordered(_run, todo):
+				results.append((job, status, seconds))
+				if status == 'rendered':
+					manifest[output_name(job)] = job_hash(job)
+		with open(manifest_path, 'w') as f:
+			json.dump(manifest, f, indent=1, sort_keys=True)
+	return results
+
+def print_summary(results):
+	""" Prints one line per job with its status and time, and the totals. """
+	width = max([len(output_name(job)) for job, _, _ in results] + [6])
+	print('{:{w}}  {:>8}  {}'.format('output', 'seconds', 'status', w=width))
+	for job, status, seconds in sorted(results, key=lambda r: output_name(r[0])):
+		print('{:{w}}  {:8.3f}  {}'.format(output_name(job), seconds, status, \
+			w=width))
+	counts = {}
+	for _, status, _ in results:
+		counts[status.split(':')[0]] = counts.get(status.split(':')[0], 0) + 1
+	print('{} jobs, {:.3f} seconds of rendering: {}'.format(len(results), \
+		sum(r[2] for r in results), ', '.join('{} {}'.format(n, s) for s, n in \
+		sorted(counts.items()))))
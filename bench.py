@@ -0,0 +1,176 @@
+"""Benchmarks of the hot paths, run headless with python bench.py. Each case
+records its throughput (work units per second) and the peak memory it
+allocates. --save writes the results to a JSON baseline, and --compare
+checks them against one, failing on regressions beyond --tolerance."""
+
+import argparse
+import fnmatch
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+import numpy as np
+from lsystem import eval_rules, SYSTEMS, Drawer
+from automaton import Rule, OuterTotalisticRule, rule_table, generations, \
+    evolve_elementary, next_state_nD
+from geometry import RecordingTurtle, trace_derivation
+from arithmetic import poly_map, ncomponents, avg_components
+
+def _loop(func, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return time.perf_counter() - start
+
+def time_per_call(func, repeat=5, min_time=0.05):
+    """Median over repeat samples of the wall time per call of func, each
+    sample timing as many calls as take at least min_time, so that fast
+    cases are not dominated by timer and scheduling noise."""
+    number, elapsed = 1, _loop(func, 1)
+    while elapsed < min_time:
+        number = max(2*number, int(number*1.2*min_time/max(elapsed, 1e-9)))
+        elapsed = _loop(func, number)
+    samples = [elapsed] + [_loop(func, number) for _ in range(repeat - 1)]
+    return statistics.median(samples)/number
+
+def peak_memory(func, *args, **kwargs):
+    """Peak bytes allocated by Python and numpy during one call of func."""
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def _line(width, base, seed=0):
+    return np.random.RandomState(seed).randint(base, size=width)
+
+def _step_nD(grid, rule, niter):
+    for _ in range(niter):
+        grid = next_state_nD(grid, rule)
+    return grid
+
+def _drawer_strokes(seq, draw_rules):
+    drawer = Drawer(seq, draw_rules)
+    drawer.t = RecordingTurtle()
+    for _ in drawer._strokes(seq, draw_rules, 0.1):
+        pass
+
+def _build_rules(indices, base, size):
+    rule_table.cache_clear()
+    return [Rule(i, base, size) for i in indices]
+
+def cases(quick=False):
+    """Yield the benchmark cases as (name, unit, work, func), where func()
+    does work units (cells, symbols, polys, ...) of work."""
+    niter = 10 if quick else 50
+    for width in ([1000, 10000] if quick else [1000, 10000, 100000]):
+        for base, size in ((2, 3), (3, 3), (4, 5)):
+            rule, init = Rule(1234567 % base**base**size, base, size), \
+                _line(width, base)
+            yield 'next_state/w{}-b{}-s{}'.format(width, base, size), \
+                'cells', width*niter, lambda init=init, rule=rule: \
+                list(generations(init, rule, niter))
+        init = _line(width, 2)
+        yield 'plot_rules/elementary-256/w{}'.format(width), 'cells', \
+            256*width*niter, lambda init=init: evolve_elementary(init, \
+            range(256), niter)
+    for n in ([64, 256] if quick else [64, 256, 1024]):
+        grid = _line(n*n, 2).reshape(n, n)
+        for rule in (OuterTotalisticRule('B3/S23'), Rule(6**10, 2, 9)):
+            yield 'next_state_nD/{}x{}/{}'.format(n, n, type(rule).__name__), \
+                'cells', n*n*niter, lambda grid=grid, rule=rule: _step_nD(\
+                grid, rule, niter)
+    for name, system in SYSTEMS.items():
+        for k in range(system['niter'] + 2, system['niter'] + \
+                (4 if quick else 7), 2):
+            seq = eval_rules(system['rules'], k, system['init'])
+            yield 'eval_rules/{}/n{}'.format(name, k), 'symbols', \
+                len(seq), lambda system=system, k=k: eval_rules(\
+                system['rules'], k, system['init'])
+            yield 'drawer_strokes/{}/n{}'.format(name, k), 'symbols', \
+                len(seq), lambda seq=seq, system=system: _drawer_strokes(seq, \
+                system['draw_rules'])
+            yield 'trace_derivation/{}/n{}'.format(name, k), 'symbols', \
+                len(seq), lambda system=system, k=k: trace_derivation(\
+                system['rules'], k, system['init'], system['draw_rules'])
+    for p in ([101, 1009] if quick else [101, 1009, 10007, 100003]):
+        coefs = _line(3*64, p).reshape(64, 3)
+        yield 'ncomponents/p{}'.format(p), 'nodes', 64*p, \
+            lambda coefs=coefs, p=p: [ncomponents(poly_map(c, p)) for c in \
+            coefs]
+    for p, deg in ((13, 2), (31, 2)) if quick else ((13, 2), (31, 2), (53, 2)):
+        yield 'avg_components/p{}-d{}'.format(p, deg), 'polys', \
+            p**(deg + 1), lambda p=p, deg=deg: avg_components(p, deg)
+    for base, size in ((2, 3), (3, 3), (2, 9), (4, 5)):
+        indices = [i % base**base**size for i in _line(64, 2**62).tolist()]
+        yield 'Rule/b{}-s{}'.format(base, size), 'rules', len(indices), \
+            lambda indices=indices, base=base, size=size: _build_rules(\
+            indices, base, size)
+
+def run(pattern='*', quick=False, repeat=5, min_time=0.05):
+    """Run the cases whose name matches the glob pattern, timed by
+    time_per_call. Returns {name: {'unit', 'work', 'seconds', 'rate',
+    'peak'}}, seconds being per call."""
+    results = {}
+    for name, unit, work, func in cases(quick):
+        if not fnmatch.fnmatch(name, pattern):
+            continue
+        seconds = time_per_call(func, repeat, min_time)
+        results[name] = {'unit': unit, 'work': work, 'seconds': seconds, \
+            'rate': work/max(seconds, 1e-9), 'peak': peak_memory(func)}
+    return results
+
+def compare(results, baseline, tolerance=0.2):
+    """Return the list of (name, what, new, old) regressions of results
+    against baseline: rates below (1 - tolerance) times their baseline and
+    peak memory above (1 + tolerance) times it."""
+    regressions = []
+    for name, new in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None:
+            continue
+        if new['rate'] < (1 - tolerance)*old['rate']:
+            regressions.append((name, 'rate', new['rate'], old['rate']))
+        if new['peak'] > (1 + tolerance)*old['peak']:
+            regressions.append((name, 'peak', new['peak'], old['peak']))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the CA, \
+        l-system and arithmetic hot paths.')
+    parser.add_argument('-k', dest='pattern', default='*', help='Only run \
+        cases matching this glob, e.g. "eval_rules/*".')
+    parser.add_argument('--quick', action='store_true', help='Smaller sizes.')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing \
+        samples per case, of which the median is kept.')
+    parser.add_argument('--min-time', dest='min_time', type=float, \
+        default=0.05, help='Least seconds per timing sample; fast cases are \
+        called repeatedly to fill it.')
+    parser.add_argument('--save', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='JSON baseline to check against.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed \
+        relative loss of throughput or growth of peak memory.')
+    args = parser.parse_args(argv)
+    results = run(args.pattern, args.quick, args.repeat, args.min_time)
+    print('{:44} {:>10} {:>14} {:>8} {:>12}'.format('case', 'seconds', \
+        'rate', 'unit', 'peak KiB'))
+    for name, r in results.items():
+        print('{:44} {:10.4f} {:14.0f} {:>8} {:12.0f}'.format(name, \
+            r['seconds'], r['rate'], r['unit'] + '/s', r['peak']/1024))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, what, new, old in regressions:
+            print('REGRESSION {} {}: {:.4g} vs baseline {:.4g}'.format(name, \
+                what, new, old))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
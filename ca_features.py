@@ -0,0 +1,208 @@
+"""Compact features of 1D rules for training classifiers against
+ca_train.ca_classes, in place of the raw spacetime pixels. Each rule is run
+from init for niter iterations and summarized by FEATURES: cell density,
+spatial and temporal block entropies, Lempel-Ziv (zlib) compressibility, the
+detected period, and the frequencies of the spatial blocks of BLOCK cells.
+
+Features are computed in chunks of rules across a pool of processes and
+cached on disk per (base, size, niter, init), one file per chunk of CHUNK
+consecutive rule indices, so rules are only ever simulated once. Batches are
+streamed in order, so rule spaces of millions of rules never need to fit in
+memory, e.g. to train with partial_fit:
+
+    for indices, X in iter_batches(range(10**6), base=3):
+        clf.partial_fit(X, labels_of(indices), classes=...)
+"""
+
+import hashlib
+import json
+import os
+import multiprocessing as mp
+from collections import deque
+import numpy as np
+from automaton import Rule, generations, evolve_elementary
+from classify import compressibility
+
+FEATURES = ['density', 'final_density', 'spatial_entropy', \
+    'temporal_entropy', 'lz_complexity', 'period']
+BLOCK = 3
+CHUNK = 1024
+CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+    '.ca-features')
+
+def feature_names(base=2):
+    """Names of the columns of the feature matrices of rules of base."""
+    return FEATURES + ['block_{}'.format(np.base_repr(k, base).zfill(BLOCK)) \
+        for k in range(base**BLOCK)]
+
+def default_init(niter):
+    """2*niter cells with a 1 in the center, as in runner.py."""
+    init = np.zeros(2*niter, dtype=np.uint8)
+    init[niter] = 1
+    return init
+
+def diagrams(indices, init, niter, base=2, size=3):
+    """Spacetime diagrams of the rules indices, shape (len(indices), niter +
+    1, len(init)), with the boundary padded by 0s as in plot_rules()."""
+    if base == 2 and size == 3:
+        return evolve_elementary(init, indices, niter)
+    out = np.empty((len(indices), niter + 1, len(init)), dtype=np.uint8)
+    for k, index in enumerate(indices):
+        for t, state in enumerate(generations(init, Rule(index, base, size), \
+                niter)):
+            out[k, t] = state
+    return out
+
+def block_codes(cells, k, base, axis):
+    """Base-base codes of the runs of k cells along axis of cells."""
+    n = cells.shape[axis] - k + 1
+    codes = np.zeros(cells.shape[:axis] + (n,) + cells.shape[axis:][1:], \
+        dtype=np.int64)
+    for j in range(k):
+        codes = codes*base + np.take(cells, range(j, j + n), axis=axis)
+    return codes
+
+def block_frequencies(codes, nblocks):
+    """Frequencies of the block codes of each rule (first axis)."""
+    rows = codes.reshape(len(codes), -1)
+    counts = np.bincount((rows + nblocks*np.arange(len(rows))[:, None])\
+        .ravel(), minlength=len(rows)*nblocks).reshape(len(rows), nblocks)
+    return counts/np.maximum(1, counts.sum(axis=1, keepdims=True))
+
+def entropy(frequencies):
+    """Shannon entropy of each row of frequencies, normalized to [0, 1]."""
+    p = np.where(frequencies > 0, frequencies, 1)
+    return -(frequencies*np.log(p)).sum(axis=1)/np.log(frequencies.shape[1])
+
+def detect_period(cells, max_period=None):
+    """Least q such that the last generation of each diagram repeats the one
+    q generations before, or 0 if none does."""
+    T = cells.shape[1]
+    max_period = T - 1 if max_period is None else min(max_period, T - 1)
+    period = np.zeros(len(cells), dtype=np.int64)
+    for q in range(1, max_period + 1):
+        repeats = (cells[:, -1] == cells[:, -1 - q]).all(axis=1)
+        period[(period == 0) & repeats] = q
+    return period
+
+def extract(cells, base=2):
+    """Feature matrix (float32, columns feature_names(base)) of the
+    diagrams cells. Entropies and block frequencies are taken over the
+    second half of the generations, after most transients."""
+    cells = np.asarray(cells)
+    steady = cells[:, cells.shape[1]//2:]
+    nblocks = base**BLOCK
+    spatial = block_frequencies(block_codes(steady, BLOCK, base, 2), nblocks)
+    temporal = block_frequencies(block_codes(steady, min(BLOCK, \
+        steady.shape[1]), base, 1), base**min(BLOCK, steady.shape[1]))
+    scale = max(1, base - 1)
+    columns = [cells.mean(axis=(1, 2))/scale, \
+        cells[:, -1].mean(axis=1)/scale, entropy(spatial), entropy(temporal), \
+        np.array([compressibility(c, base) for c in cells]), \
+        detect_period(cells)]
+    return np.column_stack(columns + [spatial]).astype(np.float32)
+
+def _key(base, size, niter, init):
+    digest = hashlib.sha1(np.asarray(init, dtype=np.uint8).tobytes())\
+        .hexdigest()[:12]
+    return 'b{}-s{}-n{}-{}'.format(base, size, niter, digest)
+
+def _chunk_path(cache, key, chunk):
+    return os.path.join(cache, key, '{}.npz'.format(chunk))
+
+def _load_chunk(path):
+    """Rule indices (as Python ints, which may exceed 64 bits) and features
+    of a chunk file."""
+    if not os.path.exists(path):
+        return [], None
+    with np.load(path) as f:
+        return [int(i) for i in f['indices']], f['features']
+
+def _features(task):
+    """Return the indices of a task and their features, read from and added
+    to the cache file of their chunk."""
+    indices, init, niter, base, size, cache = task
+    if cache is None:
+        return indices, extract(diagrams(indices, init, niter, base, size), \
+            base)
+    key = _key(base, size, niter, init)
+    path = _chunk_path(cache, key, indices[0]//CHUNK)
+    cached, features = _load_chunk(path)
+    missing = sorted(set(indices) - set(cached))
+    if missing:
+        new = extract(diagrams(missing, init, niter, base, size), base)
+        cached += missing
+        features = new if features is None else np.concatenate([features, \
+            new])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        meta = os.path.join(cache, key, 'meta.json')
+        if not os.path.exists(meta):
+            with open(meta, 'w') as f:
+                json.dump({'base': base, 'size': size, 'niter': niter, \
+                    'init': [int(c) for c in init], \
+                    'features': feature_names(base)}, f)
+        # batches of one chunk computed at once may overwrite each other's
+        # additions, which are then only recomputed
+        tmp = '{}.{}.tmp.npz'.format(path, os.getpid())
+        np.savez(tmp, indices=np.array([str(i) for i in cached]), \
+            features=features)
+        os.replace(tmp, path)
+    rows = {i: k for k, i in enumerate(cached)}
+    return indices, features[[rows[i] for i in indices]]
+
+def _tasks(indices, batch_size, init, niter, base, size, cache):
+    """Batches of indices of at most batch_size, split at chunk bounds."""
+    batch = []
+    for index in indices:
+        index = int(index)
+        if batch and (len(batch) == batch_size or \
+                index//CHUNK != batch[0]//CHUNK):
+            yield (batch, init, niter, base, size, cache)
+            batch = []
+        batch.append(index)
+    if batch:
+        yield (batch, init, niter, base, size, cache)
+
+def iter_batches(indices, niter=20, init=None, base=2, size=3, \
+        batch_size=CHUNK, cache=CACHE, processes=None):
+    """Yield (batch indices, feature matrix) for the rules indices (any
+    iterable, consumed lazily), in order, computed across a pool of
+    processes (all cpus but one by default) or read from the cache (None to
+    disable it). At most two batches per process are in flight at a time.
+    init defaults to default_init(niter)."""
+    init = default_init(niter) if init is None else np.asarray(init, \
+        dtype=np.uint8)
+    if processes is None:
+        processes = max(1, mp.cpu_count() - 1)
+    tasks = _tasks(indices, batch_size, init, niter, base, size, cache)
+    if processes == 1:
+        for task in tasks:
+            yield _features(task)
+        return
+    with mp.Pool(processes) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.apply_async(_features, (task,)))
+            if len(pending) >= 2*processes:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+def features(indices, **kwargs):
+    """Feature matrix of all rules indices, see iter_batches."""
+    batches = [X for _, X in iter_batches(indices, **kwargs)]
+    return np.concatenate(batches) if batches else np.empty((0, 0))
+
+
+if __name__ == '__main__':
+    import time
+    from ca_train import ca_classes
+    start = time.perf_counter()
+    X = features(range(256))
+    print('{} features of 256 rules in {:.2f}s'.format(X.shape[1], \
+        time.perf_counter() - start))
+    labels = sorted(set(ca_classes.values()))
+    y = np.array([labels.index(ca_classes[i]) for i in range(256)])
+    for label in labels:
+        print('{:12} {}'.format(label, np.round(X[y == labels.index(label), \
+            :len(FEATURES)].mean(axis=0), 2)))
@@ -0,0 +1,199 @@
+"""Labels rules with the classes of ca_train.ca_classes by running them on a
+ring of cells until a generation repeats. Rules that reach no cycle within
+the budget are told apart by how well their spacetime diagram compresses.
+Elementary rules are run in batches on bit-packed states, whose
+generations are hashed all at once to find their cycles."""
+
+import zlib
+import multiprocessing as mp
+from functools import partial
+import numpy as np
+from automaton import Rule, next_state, evolve_packed, unpack_bits
+
+def find_cycle(init, rule, niter):
+    """Run rule on the ring init for at most niter iterations. Return the
+    tuple (transient, period, history) where history holds the generations up
+    to the first repeated one, or (None, None, history) if none repeats."""
+    state = np.asarray(init, dtype=np.uint8)
+    seen, history = {}, []
+    for t in range(niter + 1):
+        key = state.tobytes()
+        if key in seen:
+            return seen[key], t - seen[key], history
+        seen[key] = t
+        history.append(state)
+        state = next_state(state, rule, wrap=True).astype(np.uint8)
+    return None, None, history
+
+def is_rotation(a, b):
+    """Whether the ring b is a rotation of the ring a."""
+    a, b = np.asarray(a, dtype=np.uint8), np.asarray(b, dtype=np.uint8)
+    return len(a) == len(b) and np.concatenate((a, a)).tobytes()\
+        .find(b.tobytes()) >= 0
+
+def shift_period(history, transient, period):
+    """Smallest number of generations after which the cycle starting at
+    transient in history repeats up to a rotation of the ring."""
+    for q in range(1, period):
+        if period % q == 0 and is_rotation(history[transient], \
+                history[transient + q]):
+            return q
+    return period
+
+def compressibility(history, base=2):
+    """Compressed size over raw size of the spacetime diagram history, close
+    to 1 for random-looking diagrams."""
+    cells = np.asarray(history, dtype=np.uint8)
+    if base == 2:
+        cells = np.packbits(cells)
+    raw = cells.tobytes()
+    return len(zlib.compress(raw, 9))/max(1, len(raw))
+
+def label(init, rule, niter, thresholds=(0.25, 0.5)):
+    """Return the (label, transient, period, score) of rule run on the ring
+    init, where period is taken up to rotations and score is the
+    compressibility() of the diagram when no cycle was found. Diagrams with
+    a score below thresholds[0] are labelled Periodic, below thresholds[1]
+    Complex and Chaotic above."""
+    transient, period, history = find_cycle(init, rule, niter)
+    return label_history(history, transient, period, rule.base, thresholds)
+
+def label_history(history, transient, period, base=2, \
+        thresholds=(0.25, 0.5)):
+    """label() from the result of find_cycle()."""
+    if transient is None:
+        score = compressibility(history, base)
+        names = ('Periodic', 'Complex', 'Chaotic')
+        return names[np.searchsorted(thresholds, score)], None, None, score
+    period = shift_period(history, transient, period)
+    if period == 1:
+        cycle = history[transient]
+        name = 'Null' if (cycle == cycle[0]).all() else 'Fixed-Point'
+    else:
+        name = 'Two-Cycle' if period == 2 else 'Periodic'
+    return name, transient, period, None
+
+def hash_states(packed):
+    """64-bit hashes of the bit-packed states along the last axis."""
+    h = np.zeros(packed.shape[:-1], dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for k in range(packed.shape[-1]):
+            h = (h ^ packed[..., k])*np.uint64(0x9E3779B97F4A7C15)
+            h ^= h >> np.uint64(29)
+    return h
+
+def first_repeats(hashes):
+    """For each column of hashes, the first row whose hash occurs in an
+    earlier row, or len(hashes) if none does."""
+    # sorting stably, the second of each run of equal hashes is a repeat,
+    # and the earliest such repeat is the first one
+    order = np.argsort(hashes, axis=0, kind='stable')
+    ordered = np.take_along_axis(hashes, order, axis=0)
+    repeats = np.where(ordered[1:] == ordered[:-1], order[1:], len(hashes))
+    return repeats.min(axis=0, initial=len(hashes))
+
+def find_cycles(init, indices, niter, block=64):
+    """find_cycle() for every elementary rule index in indices at once.
+    Returns the arrays (transients, periods), -1 where no generation repeats,
+    and the bit-packed histories of shape (niter + 1, len(indices), words),
+    complete up to the first repeated generation of each rule. Rules are
+    simulated block generations at a time (doubling each time), and drop out
+    once they repeat."""
+    indices = np.asarray(indices, dtype=np.uint64)
+    words = -(-len(init)//64)
+    packed = np.zeros((niter + 1, len(indices), words), dtype=np.uint64)
+    hashes = np.zeros((niter + 1, len(indices)), dtype=np.uint64)
+    first = np.full(len(indices), niter + 1)
+    active, state, t = np.arange(len(indices)), np.asarray(init), 0
+    while len(active):
+        steps = min(block, niter - t)
+        history = evolve_packed(state, indices[active], steps, wrap=True)
+        packed[t:t + steps + 1, active] = history
+        hashes[t:t + steps + 1, active] = hash_states(history)
+        t += steps
+        repeats = first_repeats(hashes[:t + 1, active])
+        done = repeats <= t
+        first[active[done]] = repeats[done]
+        if t == niter:
+            break
+        active, state = active[~done], unpack_bits(history[-1, ~done], \
+            len(init))
+        block *= 2
+    cycled = np.flatnonzero(first <= niter)
+    transients = np.full(len(first), -1)
+    periods = np.full(len(first), -1)
+    if len(cycled):
+        t = first[cycled]
+        matches = (hashes[:, cycled] == hashes[t, cycled]) & \
+            (np.arange(niter + 1)[:, None] < t)
+        transients[cycled] = matches.argmax(axis=0)
+        periods[cycled] = t - transients[cycled]
+    return transients, periods, packed
+
+def label_elementary(init, indices, niter, thresholds=(0.25, 0.5)):
+    """List of the label() of every elementary rule index in indices run on
+    the ring init, simulated together by find_cycles()."""
+    transients, periods, packed = find_cycles(init, indices, niter)
+    labels = []
+    for k, (index, transient, period) in enumerate(zip(indices, transients, \
+            periods)):
+        if transient < 0:
+            history = unpack_bits(packed[:, k], len(init))
+            labels.append(label_history(history, None, None, 2, thresholds))
+            continue
+        history = unpack_bits(packed[:transient + period, k], len(init))
+        if (packed[transient, k] != packed[transient + period, k]).any():
+            # a hash collision: fall back to the exact search
+            labels.append(label(init, Rule(index), niter, thresholds))
+            continue
+        labels.append(label_history(history, int(transient), int(period), \
+            2, thresholds))
+    return labels
+
+def random_init(width, base=2, seed=0):
+    """Reproducible random ring of width cells."""
+    return np.random.RandomState(seed).randint(base, size=width)
+
+def label_rule(index, base=2, size=3, width=149, niter=2000, seed=0, \
+        thresholds=(0.25, 0.5)):
+    """label() for the rule index started from random_init(width, base,
+    seed)."""
+    init = random_init(width, base, seed)
+    if base == 2 and size == 3:
+        return label_elementary(init, [index], niter, thresholds)[0]
+    return label(init, Rule(index, base, size), niter, thresholds=thresholds)
+
+def _label_batch(indices, width, niter, seed, thresholds):
+    return label_elementary(random_init(width, 2, seed), indices, niter, \
+        thresholds)
+
+def classify(indices, base=2, size=3, width=149, niter=2000, seed=0, \
+        thresholds=(0.25, 0.5), processes=None, chunksize=16, batch=256):
+    """Return {index: label_rule(index, ...)} for all rule indices, labelled
+    across a pool of processes (all cpus but one by default). Elementary
+    rules are labelled batch at a time by label_elementary()."""
+    indices = list(indices)
+    if processes is None:
+        processes = max(1, mp.cpu_count() - 1)
+    if base == 2 and size == 3:
+        batches = [indices[k:k + batch] for k in range(0, len(indices), \
+            batch)]
+        func = partial(_label_batch, width=width, niter=niter, seed=seed, \
+            thresholds=thresholds)
+        if processes == 1 or len(batches) <= 1:
+            results = list(map(func, batches))
+        else:
+            with mp.Pool(processes=processes) as pool:
+                results = pool.map(func, batches)
+        return dict(zip(indices, (l for labels in results for l in labels)))
+    func = partial(label_rule, base=base, size=size, width=width, \
+        niter=niter, seed=seed, thresholds=thresholds)
+    with mp.Pool(processes=processes) as pool:
+        return dict(zip(indices, pool.map(func, indices, chunksize=chunksize)))
+
+
+if __name__ == '__main__':
+    from ca_train import ca_classes
+    labels = classify(range(256))
+    agree = sum(labels[i][0] == ca_classes[i] for i in range(256))
+    print('{} of 256 labels agree with ca_train.ca_classes'.format(agree))
@@ -0,0 +1,337 @@
+""" Headless turtle geometry for l-systems: the symbols of a sequence are
+traced by a RecordingTurtle into an array of line segments, which render()
+draws with matplotlib, without a display or the Tk turtle.
+"""
+
+from collections import OrderedDict
+from inspect import signature, Parameter
+from math import cos, sin, radians
+import numpy as np
+from profiling import stage
+
+# columns of a segment array
+X0, Y0, X1, Y1, DEPTH, INDEX = range(6)
+
+def _takes_depth(func):
+	try:
+		params = signature(func).parameters.values()
+	except (TypeError, ValueError):
+		return True
+	return any(p.name == 'depth' or p.kind == Parameter.VAR_KEYWORD for p in \
+		params)
+
+def normalize_draw_rules(draw_rules):
+	""" Returns draw_rules as a dictionary from symbols to lists of (function,
+	takes_depth) pairs, where a draw rule is a function or a tuple of functions
+	called with the keywords t, step and, if they accept it, depth.
+	"""
+	return {c: [(f, _takes_depth(f)) for f in (rule if isinstance(rule, \
+		(tuple, list)) else (rule,))] for c, rule in draw_rules.items()}
+
+def apply_draw_rule(funcs, t, step, depth):
+	""" Calls the functions of a normalized draw rule on the turtle t. """
+	for func, takes_depth in funcs:
+		if takes_depth:
+			func(t=t, step=step, depth=depth)
+		else:
+			func(t=t, step=step)
+
+class RecordingTurtle(object):
+	""" Stand-in for a turtle.Turtle that records the lines it draws instead of
+	drawing them. It supports the motion, heading and pen methods draw rules
+	use; pen colors and sizes are left to render().
+	"""
+	def __init__(self, heading=90):
+		self.x, self.y, self.angle = 0.0, 0.0, float(heading)
+		self.down = True
+		self.depth, self.index = 0, 0
+		self.lines = []
+		self.relative = True    # whether only relative moves were made
+
+	def forward(self, distance):
+		x, y = self.x, self.y
+		self.x += distance*cos(radians(self.angle))
+		self.y += distance*sin(radians(self.angle))
+		if self.down:
+			self.lines.append((x, y, self.x, self.y, self.depth, self.index))
+	fd = forward
+
+	def backward(self, distance):
+		self.forward(-distance)
+	back = bk = backward
+
+	def left(self, angle):
+		self.angle = (self.angle + angle) % 360
+	lt = left
+
+	def right(self, angle):
+		self.left(-angle)
+	rt = right
+
+	def heading(self):
+		return self.angle
+
+	def setheading(self, angle):
+		self.relative = False
+		self.angle = angle % 360
+	seth = setheading
+
+	def position(self):
+		return self.x, self.y
+	pos = position
+
+	def xcor(self):
+		return self.x
+
+	def ycor(self):
+		return self.y
+
+	def goto(self, x, y=None):
+		self.relative = False
+		if y is None:
+			x, y = x
+		if self.down:
+			self.lines.append((self.x, self.y, x, y, self.depth, self.index))
+		self.x, self.y = x, y
+	setpos = setposition = goto
+
+	def penup(self):
+		self.relative = False
+		self.down = False
+	pu = up = penup
+
+	def pendown(self):
+		self.down = True
+	pd = down = pendown
+
+	def isdown(self):
+		return self.down
+
+	def _ignore(self, *args, **kwargs):
+		pass
+	pensize = width = pencolor = color = speed = hideturtle = ht = \
+		showturtle = st = _ignore
+
+	def segments(self):
+		""" Returns the recorded lines as an array of rows (x0, y0, x1, y1,
+		depth, index), index being the position of the symbol that drew it.
+		"""
+		return np.array(self.lines, dtype=float).reshape(-1, 6)
+
+@stage('geometry.trace', items=lambda traced: traced[1])
+def trace(seq, draw_rules, step=0.1, pushpop='[]', init_angle=90):
+	""" Follows the symbols of seq (any iterable) with draw_rules, like
+	Drawer, and returns the segment array (see RecordingTurtle.segments) and
+	the number of symbols. Symbols in pushpop save and restore the heading and
+	position on a stack.
+	"""
+	t = RecordingTurtle(heading=init_angle)
+	rules, push, pop = normalize_draw_rules(draw_rules), pushpop[0], pushpop[1]
+	stack, i = [], -1
+	for i, c in enumerate(seq):
+		t.index = i
+		if c == push:
+			stack.append((t.angle, t.x, t.y))
+			t.depth += 1
+		elif c == pop:
+			t.angle, t.x, t.y = stack.pop()
+			t.depth -= 1
+		if c in rules:
+			apply_draw_rule(rules[c], t, step, t.depth)
+	return t.segments(), i + 1
+
+class NotMemoizable(ValueError):
+	pass
+
+class GeometryCache(object):
+	""" LRU cache of traced sub-derivations, keyed by (symbol, number of
+	rewrites left), holding at most max_bytes of segments. A cache belongs to
+	one l-system, draw rules and step.
+	"""
+	def __init__(self, max_bytes=2**28):
+		self.max_bytes = max_bytes
+		self.blocks = OrderedDict()
+		self.nbytes = 0
+		self.hits = self.misses = self.evictions = 0
+		self.owner = None
+
+	def get(self, key):
+		block = self.blocks.get(key)
+		if block is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+			self.blocks.move_to_end(key)
+		return block
+
+	def put(self, key, block):
+		if block[0].nbytes > self.max_bytes:
+			return
+		self.blocks[key] = block
+		self.nbytes += block[0].nbytes
+		while self.nbytes > self.max_bytes:
+			_, (segments, _, _) = self.blocks.popitem(last=False)
+			self.nbytes -= segments.nbytes
+			self.evictions += 1
+
+	def clear(self):
+		self.blocks.clear()
+		self.nbytes = 0
+
+	@property
+	def hit_rate(self):
+		return self.hits/max(1, self.hits + self.misses)
+
+	def stats(self):
+		return {'hits': self.hits, 'misses': self.misses, \
+			'evictions': self.evictions, 'hit_rate': self.hit_rate, \
+			'entries': len(self.blocks), 'bytes': self.nbytes}
+
+def transform(segments, pose, depth=0, offset=0):
+	""" Moves segments traced from the origin facing 0 degrees to start at
+	pose (x, y, angle), shifting their depth and symbol index.
+	"""
+	x, y, angle = pose
+	c, s = cos(radians(angle)), sin(radians(angle))
+	out = np.empty_like(segments)
+	for cx, cy in ((X0, Y0), (X1, Y1)):
+		out[:, cx] = x + c*segments[:, cx] - s*segments[:, cy]
+		out[:, cy] = y + s*segments[:, cx] + c*segments[:, cy]
+	out[:, DEPTH] = segments[:, DEPTH] + depth
+	out[:, INDEX] = segments[:, INDEX] + offset
+	return out
+
+def compose(pose, move):
+	""" Pose reached by making the relative move (x, y, angle) from pose. """
+	x, y, angle = pose
+	c, s = cos(radians(angle)), sin(radians(angle))
+	return x + c*move[0] - s*move[1], y + s*move[0] + c*move[1], \
+		(angle + move[2]) % 360
+
+class _MemoTracer(object):
+	""" Traces derivations from blocks (segments, end pose, number of symbols)
+	of the sub-derivations, each traced once from the origin facing 0 degrees
+	and then moved into place. Raises NotMemoizable when the drawing of a
+	block depends on more than its starting pose.
+	"""
+	def __init__(self, rules, draw_rules, step, pushpop, cache):
+		if any(callable(r) for r in rules.values()):
+			raise NotMemoizable('stochastic rules')
+		self.draw_rules = normalize_draw_rules(draw_rules)
+		if any(d for funcs in self.draw_rules.values() for _, d in funcs):
+			raise NotMemoizable('draw rules depending on depth')
+		self.rules, self.step = rules, step
+		self.push, self.pop = pushpop[0], pushpop[1]
+		# rules by content, and draw rules by the functions themselves, which
+		# the owner keeps alive so that they compare by identity safely
+		owner = (tuple(sorted(rules.items())), tuple(sorted(((c, \
+			tuple(f for f, _ in funcs)) for c, funcs in \
+			self.draw_rules.items()), key=lambda item: item[0])), step, \
+			pushpop)
+		if cache.owner != owner:
+			cache.clear()
+			cache.owner = owner
+		self.cache = cache
+
+	def block(self, c, k):
+		""" Block of symbol c rewritten k more times. """
+		k = k if c in self.rules else 0
+		block = self.cache.get((c, k))
+		if block is not None:
+			return block
+		if k == 0:
+			t = RecordingTurtle(heading=0)
+			if c in self.draw_rules:
+				apply_draw_rule(self.draw_rules[c], t, self.step, 0)
+			if not t.relative:
+				raise NotMemoizable('draw rules with absolute moves')
+			block = (t.segments(), (t.x, t.y, t.angle), 1)
+		else:
+			segments, pose, n = self.sequence(self.rules[c], k - 1, \
+				(0.0, 0.0, 0.0))
+			block = (segments, pose, n)
+		self.cache.put((c, k), block)
+		return block
+
+	def sequence(self, seq, k, pose):
+		""" Segments, end pose and number of symbols of the symbols of seq
+		each rewritten k more times, starting at pose.
+		"""
+		parts, stack, depth, offset = [], [], 0, 0
+		for c in seq:
+			if (k == 0 or c not in self.rules) and c in (self.push, self.pop):
+				if c == self.push:
+					stack.append((pose, depth))
+					depth += 1
+				elif stack:
+					pose, depth = stack.pop()
+				else:
+					raise NotMemoizable('unbalanced push and pop')
+			segments, move, n = self.block(c, k)
+			if len(segments):
+				parts.append(transform(segments, pose, depth, offset))
+			pose, offset = compose(pose, move), offset + n
+		if stack:
+			raise NotMemoizable('unbalanced push and pop')
+		segments = np.concatenate(parts) if parts else np.empty((0, 6))
+		return segments, pose, offset
+
+@stage('geometry.trace_derivation', items=lambda traced: traced[1])
+def trace_derivation(rules, niter, init, draw_rules, step=0.1, \
+		pushpop='[]', init_angle=90, cache=None):
+	""" Same as trace(iter_rules(rules, niter, init), draw_rules, ...), but
+	for deterministic rules and draw rules that only turn and move relative to
+	the turtle (and ignore depth), assembled from the cached traces of every
+	(symbol, rewrites left) pair, so each distinct sub-derivation is traced
+	once. Falls back to trace() otherwise.
+	"""
+	try:
+		tracer = _MemoTracer(rules, draw_rules, step, pushpop, \
+			GeometryCache() if cache is None else cache)
+		segments, _, n = tracer.sequence(init, niter, (0.0, 0.0, init_angle))
+		return segments, n
+	except NotMemoizable:
+		from lsystem import iter_rules
+		return trace(iter_rules(rules, niter, init), draw_rules, step=step, \
+			pushpop=pushpop, init_angle=init_angle)
+
+def bounds(segments, margin_scale=1/5):
+	""" Square (xmin, ymin, xmax, ymax) around the segments with a margin of
+	margin_scale times their extent, as Drawer frames its drawing.
+	"""
+	if not len(segments):
+		return -1, -1, 1, 1
+	xs, ys = segments[:, [X0, X1]], segments[:, [Y0, Y1]]
+	xmin, ymin, xmax, ymax = xs.min(), ys.min(), xs.max(), ys.max()
+	maxdist = max(xmax - xmin, ymax - ymin) or 1
+	xpad = (maxdist - (xmax - xmin) + maxdist*margin_scale)/2
+	ypad = (maxdist - (ymax - ymin) + maxdist*margin_scale)/2
+	return xmin - xpad, ymin - ypad, xmax + xpad, ymax + ypad
+
+@stage('geometry.render')
+def render(segments, filename, length=None, cmap=None, pensize=1, \
+		margin_scale=1/5, size=4, dpi=100):
+	""" Draws the segments to filename (the format is taken from its
+	extension, e.g. png or svg) on a size by size inches figure. Segments are
+	colored by cmap at the position of their symbol over length.
+	"""
+	from matplotlib.backends.backend_agg import FigureCanvasAgg
+	from matplotlib.collections import LineCollection
+	from matplotlib.figure import Figure
+	fig = Figure(figsize=(size, size), dpi=dpi)
+	FigureCanvasAgg(fig)
+	ax = fig.add_axes((0, 0, 1, 1))
+	ax.axis('off')
+	if cmap is None:
+		colors = 'black'
+	else:
+		length = length or int(segments[:, INDEX].max(initial=0)) + 1
+		colors = cmap(segments[:, INDEX]/length)
+	lines = segments[:, [X0, Y0, X1, Y1]].reshape(-1, 2, 2)
+	ax.add_collection(LineCollection(lines, colors=colors, linewidths=pensize, \
+		capstyle='round'))
+	xmin, ymin, xmax, ymax = bounds(segments, margin_scale)
+	ax.set_xlim(xmin, xmax)
+	ax.set_ylim(ymin, ymax)
+	ax.set_aspect('equal')
+	fig.savefig(filename, dpi=dpi)
@@ -0,0 +1,232 @@
+"""HashLife: automata on an unbounded quiescent background stored as
+hash-consed trees (binary trees in 1D, quadtrees in 2D) whose memoized
+results let a run jump 2**k generations at once. See Gosper, 'Exploiting
+regularities in large cellular spaces' (1984)."""
+
+from collections import OrderedDict
+from itertools import product
+import numpy as np
+from automaton import apply_rule
+
+class Node(object):
+    """Canonical tree node of the given level, covering 2**level cells per
+    axis. children holds the 2**ndim nodes of level - 1 in C order (plain ints
+    for level 1), and population counts its non zero cells."""
+    __slots__ = ('children', 'level', 'population')
+
+    def __init__(self, children, level, population):
+        self.children = children
+        self.level = level
+        self.population = population
+
+    def __repr__(self):
+        return 'Node(level={}, population={})'.format(self.level, \
+            self.population)
+
+def flat_index(position, width):
+    """Index of the nD position in a C ordered array of the given width."""
+    index = 0
+    for p in position:
+        index = index*width + p
+    return index
+
+class HashLife(object):
+    """Runs rule (a Rule, TotalisticRule or OuterTotalisticRule of size 3 in
+    1D or 9 in 2D, mapping the all 0 neighborhood to 0) on an unbounded grid.
+    Results of nodes are kept in an LRU cache of at most cache_size entries;
+    when more than max_nodes nodes are interned after a jump, the unreachable
+    ones are dropped along with the cache. A cache much smaller than the
+    working set of a run makes it recompute, so slows it down sharply."""
+    def __init__(self, rule, cache_size=2**20, max_nodes=2**22):
+        ndim = {3: 1, 9: 2}.get(rule.size)
+        assert(ndim is not None)
+        assert(rule.table[0] == 0)
+        self.rule = rule
+        self.ndim = ndim
+        self.cache_size = cache_size
+        self.max_nodes = max_nodes
+        self.hits = self.misses = self.evictions = self.collections = 0
+        self._nodes = {}
+        self._cache = OrderedDict()
+        self._empty = [0]
+        corners = list(product((0, 1), repeat=ndim))
+        # the 3**ndim overlapping subnodes of level - 1 of a node, as (child,
+        # grandchild) pairs out of its 4**ndim grid of grandchildren
+        self._subnodes = [tuple((flat_index([a//2 for a in pos], 2), \
+            flat_index([a % 2 for a in pos], 2)) for pos in \
+            (tuple(o + q for o, q in zip(offset, c)) for c in corners)) \
+            for offset in product(range(3), repeat=ndim)]
+        self._center = self._subnodes[flat_index((1,)*ndim, 3)]
+        # the 2**ndim quarters assembled from the 3**ndim subnode results
+        self._quarters = [tuple(flat_index([a + b for a, b in zip(p, q)], 3) \
+            for q in corners) for p in corners]
+        self._border = [pair for pos, pair in zip(product(range(4), \
+            repeat=ndim), self._grandchildren()) if 0 in pos or 3 in pos]
+        self._expansion = [flat_index([1 - a for a in c], 2) for c in corners]
+        self.load(np.zeros((1,)*ndim, dtype=int))
+
+    def _grandchildren(self):
+        """(child, grandchild) pairs of the 4**ndim grid in C order."""
+        return [(flat_index([a//2 for a in pos], 2), flat_index([a % 2 for a \
+            in pos], 2)) for pos in product(range(4), repeat=self.ndim)]
+
+    def join(self, children):
+        """Return the canonical node with the given children."""
+        node = self._nodes.get(children)
+        if node is None:
+            if isinstance(children[0], Node):
+                level = children[0].level + 1
+                population = sum(c.population for c in children)
+            else:
+                level, population = 1, sum(c != 0 for c in children)
+            node = self._nodes[children] = Node(children, level, population)
+        return node
+
+    def empty(self, level):
+        """Return the canonical empty node of level."""
+        while len(self._empty) <= level:
+            self._empty.append(self.join((self._empty[-1],)*2**self.ndim))
+        return self._empty[level]
+
+    def _subnode(self, node, pairs):
+        return self.join(tuple(node.children[c].children[g] for c, g in pairs))
+
+    def _base(self, node):
+        """Center of the level 2 node advanced one generation."""
+        cells = np.reshape([node.children[c].children[g] for c, g in \
+            self._grandchildren()], (4,)*self.ndim)
+        new = apply_rule(cells, (2,)*self.ndim, 1, self.rule)
+        return self.join(tuple(int(v) for v in new.ravel()))
+
+    def successor(self, node, j):
+        """Return the center of node (level k >= 2), of level k - 1, advanced
+        2**j generations, where j <= k - 2."""
+        key = (node, j)
+        result = self._cache.get(key)
+        if result is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return result
+        self.misses += 1
+        if node.population == 0:
+            result = self.empty(node.level - 1)
+        elif node.level == 2:
+            result = self._base(node)
+        else:
+            subs = [self._subnode(node, pairs) for pairs in self._subnodes]
+            if j == node.level - 2:
+                # advance twice by 2**(k - 3): once here, once per quarter
+                j -= 1
+                subs = [self.successor(s, j) for s in subs]
+            else:
+                subs = [self._subnode(s, self._center) for s in subs]
+            result = self.join(tuple(self.successor(self.join(tuple(subs[i] \
+                for i in quarter)), j) for quarter in self._quarters))
+        self._cache[key] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+        return result
+
+    def _build(self, cells):
+        if cells.shape[0] == 1:
+            return int(cells.flat[0])
+        level = cells.shape[0].bit_length() - 1
+        if not cells.any():
+            return self.empty(level)
+        half = cells.shape[0]//2
+        return self.join(tuple(self._build(cells[tuple(slice(a*half, \
+            (a + 1)*half) for a in c)]) for c in product((0, 1), \
+            repeat=self.ndim)))
+
+    def load(self, init):
+        """Replace the grid by the nD array init, with init[0, ..., 0] at the
+        origin and 0s everywhere else."""
+        init = np.asarray(init)
+        assert(init.ndim == self.ndim)
+        level = max(2, int(np.ceil(np.log2(max(init.shape)))))
+        cells = np.zeros((2**level,)*self.ndim, dtype=int)
+        cells[tuple(slice(0, n) for n in init.shape)] = init
+        self.root = self._build(cells)
+        self.origin = (0,)*self.ndim    # coordinates of the root's 1st cell
+        self.generation = 0
+
+    def _expand(self):
+        """Center the root in a root twice as wide."""
+        level = self.root.level
+        empty = self.empty(level - 1)
+        quarters = []
+        for child, i in zip(self.root.children, self._expansion):
+            children = [empty]*2**self.ndim
+            children[i] = child
+            quarters.append(self.join(tuple(children)))
+        self.root = self.join(tuple(quarters))
+        self.origin = tuple(o - 2**(level - 1) for o in self.origin)
+
+    def jump(self, k):
+        """Advance 2**k generations."""
+        # the border check reads grandchildren, which are nodes from level 3
+        while self.root.level < max(3, k + 2) or any(self.root.children[c]\
+                .children[g].population for c, g in self._border):
+            self._expand()
+        self._expand()          # room for the pattern to grow
+        level = self.root.level
+        self.root = self.successor(self.root, k)
+        self.origin = tuple(o + 2**(level - 2) for o in self.origin)
+        self.generation += 2**k
+        if len(self._nodes) > self.max_nodes:
+            self.collect()
+
+    def step(self, niter=1):
+        """Advance niter generations, jumping by each power of 2 in niter."""
+        for k, bit in enumerate(reversed(bin(niter)[2:])):
+            if bit == '1':
+                self.jump(k)
+
+    def collect(self):
+        """Intern only the nodes reachable from the root, and clear the
+        cache."""
+        nodes, stack = {}, [self.root] + self._empty[1:]
+        while stack:
+            node = stack.pop()
+            if node.children not in nodes:
+                nodes[node.children] = node
+                if node.level > 1:
+                    stack.extend(node.children)
+        self._nodes = nodes
+        self._cache.clear()
+        self.collections += 1
+
+    @property
+    def population(self):
+        return self.root.population
+
+    def stats(self):
+        """Return the cache counters and sizes."""
+        return {'hits': self.hits, 'misses': self.misses, \
+            'evictions': self.evictions, 'collections': self.collections, \
+            'nodes': len(self._nodes), 'cached': len(self._cache), \
+            'generation': self.generation}
+
+    def to_array(self, lo=None, hi=None):
+        """Return the cells with coordinates in [lo, hi) along each axis,
+        where the initial array had its first cell at 0. Defaults to the
+        region covered by the root."""
+        size = 2**self.root.level
+        lo = self.origin if lo is None else tuple(lo)
+        hi = tuple(o + size for o in self.origin) if hi is None else tuple(hi)
+        out = np.zeros([b - a for a, b in zip(lo, hi)], dtype=int)
+        stack = [(self.root, self.origin)]
+        while stack:
+            node, corner = stack.pop()
+            if isinstance(node, Node):
+                width = 2**(node.level - 1)
+                if node.population == 0 or any(c >= b or c + 2*width <= a \
+                        for c, a, b in zip(corner, lo, hi)):
+                    continue
+                stack.extend((child, tuple(x + width*y for x, y in \
+                    zip(corner, c))) for child, c in zip(node.children, \
+                    product((0, 1), repeat=self.ndim)))
+            elif node and all(a <= c < b for c, a, b in zip(corner, lo, hi)):
+                out[tuple(c - a for c, a in zip(corner, lo))] = node
+        return out
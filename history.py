@@ -0,0 +1,113 @@
+"""Compact on-disk spacetime histories of 1D automata. A history file starts
+with MAGIC, the length of a JSON header (4 little-endian bytes) and the
+header itself, recording the rule index, base, size and init; the
+generations follow as rows of one uint8 per cell, or bit-packed rows for
+base 2. Files are appended to one generation at a time and read back through
+a memory map, so no run has to fit in memory."""
+
+import json
+import struct
+import numpy as np
+from automaton import generations
+
+MAGIC = b'CAHIST1\n'
+
+class HistoryWriter(object):
+    """Appends the generations of rule started from init to path. Use as a
+    context manager, or call close()."""
+    def __init__(self, path, rule, init):
+        self.width = len(init)
+        self.packed = rule.base == 2
+        assert(rule.base <= 256)
+        index = rule.index if isinstance(rule.index, str) else int(rule.index)
+        header = json.dumps({'index': index, 'base': rule.base, \
+            'size': rule.size, 'rule': type(rule).__name__, \
+            'width': self.width, 'packed': self.packed, \
+            'init': [int(c) for c in init]}).encode()
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC + struct.pack('<I', len(header)) + header)
+        self.rows = 0
+
+    def append(self, state):
+        state = np.asarray(state, dtype=np.uint8)
+        assert(state.shape == (self.width,))
+        self.file.write((np.packbits(state) if self.packed else state)\
+            .tobytes())
+        self.rows += 1
+
+    def extend(self, states):
+        for state in states:
+            self.append(state)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def write_history(path, init, rule, niter, **kwargs):
+    """Stream init and niter generations of rule to path, never holding more
+    than one generation in memory. kwargs go to automaton.generations()."""
+    with HistoryWriter(path, rule, init) as writer:
+        writer.extend(generations(init, rule, niter, **kwargs))
+
+class History(object):
+    """Read-only view of a history file. Indexing with rows (and optionally
+    columns), e.g. history[1000:1200, 50:150], only reads and unpacks that
+    window from disk."""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            assert(f.read(len(MAGIC)) == MAGIC)
+            length, = struct.unpack('<I', f.read(4))
+            self.header = json.loads(f.read(length).decode())
+        self.width = self.header['width']
+        self.packed = self.header['packed']
+        row_bytes = -(-self.width//8) if self.packed else self.width
+        self.rows = np.memmap(path, dtype=np.uint8, mode='r', \
+            offset=len(MAGIC) + 4 + length)
+        self.rows = self.rows[:len(self.rows)//row_bytes*row_bytes]\
+            .reshape(-1, row_bytes)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, key):
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        window = self.rows[rows]
+        if not self.packed:
+            return np.array(window[..., cols])
+        if isinstance(cols, (int, np.integer)):
+            col = cols + self.width if cols < 0 else cols
+            if not 0 <= col < self.width:
+                raise IndexError('column {} out of range'.format(cols))
+            return self._unpack(window, slice(col, col + 1))[..., 0]
+        if isinstance(cols, slice) and cols.indices(self.width)[2] > 0:
+            return self._unpack(window, cols)
+        return np.unpackbits(window, axis=-1)[..., :self.width][..., cols]
+
+    def _unpack(self, window, cols):
+        """Unpack only the bytes of the packed rows window holding the
+        columns of the slice cols, whose step is positive."""
+        start, stop, step = cols.indices(self.width)
+        stop = max(start, stop)
+        lo, hi = start//8, -(-stop//8)
+        cells = np.unpackbits(window[..., lo:hi], axis=-1)
+        return cells[..., start - 8*lo:stop - 8*lo:step]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+def plot_history(history, start=0, stop=None, cols=slice(None), \
+        cmap='Greys'):
+    """Plot generations start to stop of a History (or a path to one)."""
+    import matplotlib.pyplot as plt
+    if not isinstance(history, History):
+        history = History(history)
+    plt.imshow(history[start:stop, cols], interpolation='nearest', cmap=cmap)
+    plt.title('Rule: {}'.format(history.header['index']))
+    plt.axis('off')
+    plt.show()
@@ -1,104 +1,227 @@
-import turtle
-from queue import LifoQueue
 from itertools import takewhile
 from math import log
-from matplotlib.colors import rgb2hex
+from geometry import normalize_draw_rules, apply_draw_rule, trace, \
+	trace_derivation, render, GeometryCache
+from profiling import stage, timer, count
 
+@stage('lsystem.rewrite', items=len)
 def eval_rules(rules, niter=10, init='0'):
 	""" Evaluates the rules (a dictionary from strings to strings) for niter
-	iterations, starting with init as the initial string.
+	iterations, starting with init as the initial string. A rule may also be a
+	function returning a string, called anew for every rewritten symbol.
 	"""
 	seq = init
+	if not any(callable(r) for r in rules.values()):
+		# deterministic rules rewrite each generation with one str.translate
+		table = str.maketrans({c: r for c, r in rules.items() if len(c) == 1})
+		for _ in range(niter):
+			seq = seq.translate(table)
+		return seq
 	for _ in range(niter):
-		new_seq = ''
-		for c in seq:
-			if c in rules:
-				try:
-					new_seq += rules[c]()
-				except TypeError:
-					new_seq += rules[c]
-			else:
-				new_seq += c
-		seq = new_seq
+		seq = ''.join([(rules[c]() if callable(rules[c]) else rules[c]) if c in \
+			rules else c for c in seq])
 	return seq
 
+def iter_rules(rules, niter=10, init='0'):
+	""" Yields the symbols of eval_rules(rules, niter, init) one at a time,
+	expanding depth first with a stack of one iterator per generation, so only
+	O(niter) memory is used. Callable rules are called as their symbols get
+	expanded, which is a different order than in eval_rules.
+	"""
+	stack = [iter(init)]
+	while stack:
+		for c in stack[-1]:
+			if len(stack) <= niter and c in rules:
+				rule = rules[c]
+				stack.append(iter(rule() if callable(rule) else rule))
+				break
+			yield c
+		else:
+			stack.pop()
+
+def symbol_counts(rules, niter=10, init='0'):
+	""" Returns a dictionary from symbols to their number of occurrences in
+	eval_rules(rules, niter, init) without expanding it, by raising the
+	production matrix of the (deterministic) rules to the power niter.
+	"""
+	if any(callable(r) for r in rules.values()):
+		raise ValueError('Symbol counts of stochastic rules are not fixed.')
+	symbols = sorted(set(init) | set(''.join(rules.values())) | set(rules))
+	def produced(c):
+		return rules[c] if c in rules and len(c) == 1 else c
+	# matrix[i][j] is the number of symbols[i] produced by symbols[j]
+	matrix = [[produced(b).count(a) for b in symbols] for a in symbols]
+	counts = [init.count(a) for a in symbols]
+	def multiply(A, B):
+		return [[sum(a*b for a, b in zip(row, col)) for col in zip(*B)] \
+			for row in A]
+	while niter:
+		if niter & 1:
+			counts = [sum(m*c for m, c in zip(row, counts)) for row in matrix]
+		matrix, niter = multiply(matrix, matrix), niter >> 1
+	return {a: n for a, n in zip(symbols, counts) if n}
+
+def derivation_length(rules, niter=10, init='0'):
+	""" Returns len(eval_rules(rules, niter, init)), see symbol_counts. """
+	return sum(symbol_counts(rules, niter, init).values())
+
+class Derivation(object):
+	""" The symbols of eval_rules(rules, niter, init), produced by iter_rules
+	each time it is iterated, and whose len() comes from derivation_length.
+	Drawer traces deterministic derivations from cached sub-derivations.
+	"""
+	def __init__(self, rules, niter=10, init='0'):
+		self.rules = rules
+		self.niter = niter
+		self.init = init
+
+	def __iter__(self):
+		return iter_rules(self.rules, self.niter, self.init)
+
+	def __len__(self):
+		return derivation_length(self.rules, self.niter, self.init)
+
 class Drawer(object):
 	""" Base Drawer object initializes a turtle drawer with step size for use in
 	forward porportional to screen_x/step_scale, where screen_x is the screen
 	size. The position is also scaled similarly. Drawer only needs a sequence and
 	a drawing rule dictionary from symbols to lambda functions or tuples of 
-	lambda functions.
+	lambda functions. The sequence may be any iterable of symbols, such as
+	iter_rules(), in which case its length must be given to color it by cmap.
+	Draw rules are called with the keywords t, step and, if they take it,
+	depth. draw() uses the Tk turtle, save() renders headless to a file, using
+	a geometry.GeometryCache for Derivation sequences.
 	"""
 	def __init__(self, seq, draw_rules, speed=10, cmap=None, pensize=1, \
-			pushpop='[]', margin_scale=1/5, init_angle=90):
+			pushpop='[]', margin_scale=1/5, init_angle=90, length=None, \
+			cache=None):
 		self.seq = seq
+		self.cache = GeometryCache() if cache is None else cache
+		if length is None and cmap is not None:
+			length = len(seq)
+		self.length = length
 		self.draw_rules = draw_rules
+		self.margin_scale = margin_scale
+		self.speed = speed
+		self.pensize = pensize
+		self.init_angle = init_angle
+		self.pushpop = pushpop
+		self.push, self.pop = pushpop
+		self.cmap = cmap
+
+	def _setup_turtle(self):
+		import turtle
 		turtle.mode(mode='world')
 		turtle.setup(width=400, height=400)
-		self.margin_scale = margin_scale
 		self.screen = turtle.getscreen()
 		self.t = turtle.getturtle()
-		self.t.pensize(pensize)
-		self.t.speed(speed)
-		self.t.setheading(init_angle)
-		self.push, self.pop = pushpop
-		if cmap is None:
-			self.colors = ['black']*len(seq)
-		else:
-			self.colors = [rgb2hex(c) for c in (cmap(i/len(seq)) for i in \
-				range(len(seq)))]
+		self.t.pensize(self.pensize)
+		self.t.speed(self.speed)
+		self.t.setheading(self.init_angle)
+
+	def color(self, i):
+		""" Pen color after the i-th symbol of the sequence. """
+		if self.cmap is None:
+			return 'black'
+		from matplotlib.colors import rgb2hex
+		return rgb2hex(self.cmap(i/self.length))
 
 	def _strokes(self, seq, draw_rules, step):
 		""" Draws a seq with draw_rules when there is Lifo stacking. """
-		queue, depth = LifoQueue(), 0
+		stack, rules = [], normalize_draw_rules(draw_rules)
 		for c in seq:
 			if c == self.push:
-				queue.put((self.t.heading(), self.t.position()))
-				depth += 1
+				stack.append((self.t.heading(), self.t.position()))
 			elif c == self.pop:
-				heading, pos = queue.get()
-				depth -= 1
+				heading, pos = stack.pop()
 				self.t.penup()
 				self.t.setheading(heading)
 				self.t.setpos(pos)
 				self.t.pendown()
-			if c in draw_rules:
-				try:
-					draw_rules[c](t=self.t, step=step, depth=depth)
-				except:
-					for func in draw_rules[c]:
-						func(t=self.t, step=step, depth=depth)
+			if c in rules:
+				apply_draw_rule(rules[c], self.t, step, len(stack))
 			yield
 
 	def draw(self):
 		""" Draws the entire sequence according to self.draw_rules. It uses the
 		subroutine self.parse_seq to do the drawing.
 		"""
-		self.t.pencolor(self.colors[0])
+		import turtle
+		self._setup_turtle()
+		self.t.pencolor(self.color(0))
 		borders = (-1, -1, 1, 1)
 		rescale = 1.2
 		step = 0.1
 		turtle.setworldcoordinates(*borders)
 		(xmin, ymin), (xmax, ymax) = self.t.pos(), self.t.pos()
 		try:
-			for i, _ in enumerate(\
-					self._strokes(self.seq, self.draw_rules, step)):
-				tx, ty = self.t.pos()
-				xmin, ymin, xmax, ymax = min(xmin, tx), min(ymin, ty), \
-					max(xmax, tx), max(ymax, ty)
-				xdist, ydist = xmax - xmin, ymax - ymin
-				maxdist = max(xdist, ydist)
-				xhang, yhang = maxdist - xdist, maxdist - ydist
-				margin = maxdist*self.margin_scale
-				borders = (xmin - (xhang + margin)/2, ymin - (yhang + margin)/2, \
-					xmax + (xhang + margin)/2, ymax + (yhang + margin)/2)
-				turtle.setworldcoordinates(*borders)
-				self.t.pencolor(self.colors[i])
+			with timer('lsystem.turtle'):
+				i = -1
+				for i, _ in enumerate(\
+						self._strokes(self.seq, self.draw_rules, step)):
+					tx, ty = self.t.pos()
+					xmin, ymin, xmax, ymax = min(xmin, tx), min(ymin, ty), \
+						max(xmax, tx), max(ymax, ty)
+					xdist, ydist = xmax - xmin, ymax - ymin
+					maxdist = max(xdist, ydist)
+					xhang, yhang = maxdist - xdist, maxdist - ydist
+					margin = maxdist*self.margin_scale
+					borders = (xmin - (xhang + margin)/2, ymin - (yhang + \
+						margin)/2, xmax + (xhang + margin)/2, ymax + (yhang + \
+						margin)/2)
+					turtle.setworldcoordinates(*borders)
+					self.t.pencolor(self.color(i))
+			count('lsystem.turtle', i + 1)
 			self.t.hideturtle()
 			turtle.done()
 		except:
 			turtle.bye()
 
+	def save(self, filename, step=0.1, size=4, dpi=100):
+		""" Renders the entire sequence to filename (e.g. a png or svg) without
+		opening a window, see geometry.render.
+		"""
+		if isinstance(self.seq, Derivation):
+			segments, length = trace_derivation(self.seq.rules, self.seq.niter, \
+				self.seq.init, self.draw_rules, step=step, pushpop=self.pushpop, \
+				init_angle=self.init_angle, cache=self.cache)
+		else:
+			segments, length = trace(self.seq, self.draw_rules, step=step, \
+				pushpop=self.pushpop, init_angle=self.init_angle)
+		render(segments, filename, length=self.length or length, \
+			cmap=self.cmap, pensize=self.pensize, \
+			margin_scale=self.margin_scale, size=size, dpi=dpi)
+
+# The l-systems drawn by runner.py: production rules, axiom, draw rules,
+# default niter and initial heading.
+SYSTEMS = {
+	'plant': {'rules': {'X': 'F-[[X]+X]+F[+FX]-X', 'F': 'FF'}, 'init': 'X',
+		'draw_rules': {'F': lambda t, step: t.forward(step), 
+			'-': lambda t, step: t.left(25), 
+			'+': lambda t, step: t.right(25)},
+		'niter': 3, 'init_angle': 90},
+	'pythag': {'rules': {'1': '11', '0': '1[0]0'}, 'init': '0',
+		'draw_rules': {'1': lambda t, step: t.forward(step), 
+			'[': lambda t, step: t.left(45), ']': lambda t, step: t.right(45), 
+			'0': lambda t, step: t.forward(step/2)},
+		'niter': 5, 'init_angle': 90},
+	'koch': {'rules': {'F': 'F+F-F-F+F'}, 'init': 'F',
+		'draw_rules': {'F': lambda t, step: t.forward(step),
+			'-': lambda t, step: t.right(90),
+			'+': lambda t, step: t.left(90)},
+		'niter': 3, 'init_angle': 0},
+	'dragon': {'rules': {'X': 'X+YF+', 'Y': '-FX-Y'}, 'init': 'FX',
+		'draw_rules': {'F': lambda t, step: t.forward(step), 
+			'+': lambda t, step: t.right(90), '-': lambda t, step: t.left(90), 
+			'X': (), 'Y': ()},
+		'niter': 6, 'init_angle': 90},
+	'sierp': {'rules': {'A': 'B-A-B', 'B': 'A+B+A'}, 'init': 'A',
+		'draw_rules': {'A': lambda t, step: t.forward(step), 
+			'B': lambda t, step: t.forward(step), 
+			'+': lambda t, step: t.left(60), '-': lambda t, step: t.right(60)},
+		'niter': 4, 'init_angle': 0},
+}
+
 
 if __name__ == '__main__':
 	pass
@@ -0,0 +1,112 @@
+"""Opt-in instrumentation of the hot paths. Functions decorated with stage()
+record their calls, time and items processed (cells, symbols, ...) while
+profiling is enabled, and cost one flag check otherwise. Enable it with the
+Profile context manager (or runner.py --profile), which prints a table of
+the stages and can dump a cProfile of the whole run for pstats. Stage times
+are inclusive, e.g. ca.step includes ca.neighborhoods."""
+
+import cProfile
+import sys
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+
+_enabled = False
+_stages = {}        # name -> [calls, seconds, items]
+
+def enabled():
+    return _enabled
+
+def record(name, seconds=0.0, items=0, calls=1):
+    """Add calls, seconds and items to the stage name."""
+    totals = _stages.setdefault(name, [0, 0.0, 0])
+    totals[0] += calls
+    totals[1] += seconds
+    totals[2] += items
+
+def stage(name, items=None):
+    """Decorator timing each call of a function as the stage name while
+    profiling is enabled. items, if given, computes the number of items
+    processed from the function's result."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = perf_counter()
+            result = func(*args, **kwargs)
+            record(name, perf_counter() - start, items(result) if items else 0)
+            return result
+        return wrapper
+    return decorator
+
+@contextmanager
+def timer(name, items=0):
+    """Time a block as one call of the stage name while profiling is
+    enabled."""
+    if not _enabled:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        record(name, perf_counter() - start, items)
+
+def count(name, items=1):
+    """Count items of the stage name without timing them."""
+    if _enabled:
+        record(name, items=items, calls=0)
+
+def summary():
+    """Rows (stage, calls, seconds, items) of the recorded stages, slowest
+    first."""
+    return sorted(((name, calls, seconds, items) for name, (calls, seconds, \
+        items) in _stages.items()), key=lambda row: -row[2])
+
+def report(file=None):
+    """Print summary() as a table with mean times and item rates."""
+    file = sys.stderr if file is None else file
+    print('{:24} {:>8} {:>10} {:>10} {:>12} {:>12}'.format('stage', 'calls', \
+        'seconds', 'mean ms', 'items', 'items/s'), file=file)
+    for name, calls, seconds, items in summary():
+        print('{:24} {:8d} {:10.4f} {:10.3f} {:12d} {:12.0f}'.format(name, \
+            calls, seconds, 1000*seconds/max(1, calls), items, \
+            items/seconds if seconds else 0), file=file)
+
+class Profile(object):
+    """Enable the stages (cleared first) between start() and stop(), or
+    within a with block, and cProfile everything if dump names a file to
+    write its stats to. Prints report() on stop unless quiet."""
+    def __init__(self, dump=None, quiet=False, file=None):
+        self.dump, self.quiet, self.file = dump, quiet, file
+        self.profiler = cProfile.Profile() if dump else None
+
+    def start(self):
+        global _enabled
+        _stages.clear()
+        _enabled = True
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def stop(self):
+        global _enabled
+        if not _enabled:
+            return
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.dump)
+        _enabled = False
+        if not self.quiet:
+            report(self.file)
+            if self.dump:
+                print('cProfile stats written to {} (python -m pstats {})'\
+                    .format(self.dump, self.dump), file=self.file or \
+                    sys.stderr)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,124 +1,293 @@
 import argparse
+import atexit
+import hashlib
+import io
+import json
+import os
+import socket
+import socketserver
 import sys
-from lsystem import eval_rules, Drawer
-from automaton import plot_rules, Rule
-from itertools import chain, takewhile
-from palettable.colorbrewer.sequential import *
+import tempfile
+from contextlib import redirect_stdout, redirect_stderr
 
+# Modules are imported by the functions needing them, so that each mode
+# only pays for its own imports, and daemon clients for none.
 
 parser = argparse.ArgumentParser(description='Command-line tool plotting \
 	iterative functions. See http://nbviewer.ipython.org/github/henry-wallace/\
 	L-systems-and-CAs/blob/master/lsystems-and-cas.ipynb for full explanation.')
-parser.add_argument('-l', '--lname', nargs=1, dest='lname', help='Name of \
-	l-system, viz.: plant, pythag, koch, dragon, sierp.')
+parser.add_argument('-l', '--lname', nargs='+', dest='lname', help='Name of \
+	l-system, viz.: plant, pythag, koch, dragon, sierp. Several names may be \
+	given with --outdir.')
 parser.add_argument('-f', '--fromfile', dest='fromfile', action='store_true', \
 	help='Filename to retrieve seq, draw_rules and additional Draw kwargs.')
 parser.add_argument('-c', '--cname', dest='cname', nargs='+', help="Rule \
 	numbers for CA, e.g. '-c 100 102 120-130'.")
-parser.add_argument('-n', '--niter', dest='niter', type=int, help='Number of \
-	iterations.')
+parser.add_argument('-n', '--niter', dest='niter', nargs='+', help='Number of \
+	iterations. Several numbers and ranges, e.g. 3-6, may be given with \
+	--outdir.')
 parser.add_argument('-b', '--base', dest='base', type=int, default=2,
 	help='Size of field that CA operates on.')
 parser.add_argument('-i', '--init', dest='init', nargs='?', \
 	help="Initialization for CA, e.g. '-i 0001000'. If unspecified then an \
-	array of 2*niter 0s with a 1 in the center will be used.")
+	array of 2*niter 0s with a 1 in the center will be used, or with \
+	'-i random' or '-i random:SEED' 2*niter random cells.")
 parser.add_argument('--cmap', dest='cmap', nargs='*', help='colorbrewer sequential \
 	cmap name to be used for drawing the l-system, e.g..: GnBu_7, etc. See \
 	https://jiffyclub.github.io/palettable/colorbrewer/sequential/ for more \
 	details.')
-parser.add_argument('-p', '--pensize', dest='pensize', type=int, default=3, \
-	help='Define pensize for l-system drawer in range 1-10.')
-
-if len(sys.argv) == 1:
-	parser.print_help()
-	sys.exit(1)
-args = parser.parse_args()
-
-# L-SYSTEM DRAWING
-if args.cmap is not None:
-	if args.cmap == []:
-		args.cmap = eval('YlOrRd_9').mpl_colormap
+parser.add_argument('-p', '--pensize', dest='pensize', nargs='+', \
+	default=['3'], help='Define pensize for l-system drawer in range 1-10. \
+	Several sizes and ranges may be given with --outdir.')
+parser.add_argument('-o', '--output', dest='output', help='Save the l-system \
+	drawing to this file, e.g. plant.png or plant.svg, without opening a \
+	window.')
+parser.add_argument('--batch', dest='batch', help='JSON file of l-system \
+	rendering jobs, e.g. [{"system": ["plant", "koch"], "niter": "3-6", \
+	"cmap": "GnBu_7"}], rendered headless into --outdir.')
+parser.add_argument('--outdir', dest='outdir', help='Render every combination \
+	of the given l-systems, niters, cmaps and pensizes (and --batch jobs) to \
+	image files in this directory, skipping unchanged ones.')
+parser.add_argument('-j', '--processes', dest='processes', type=int, \
+	help='Number of processes rendering batch jobs.')
+parser.add_argument('--force', dest='force', action='store_true', \
+	help='Render batch jobs even if their output is up to date.')
+parser.add_argument('--headless', dest='headless', help='Simulate the CA \
+	rules across a pool of processes and save an image of each to this \
+	directory instead of plotting them.')
+parser.add_argument('--sheet', dest='sheet', action='store_true', \
+	help='With --headless, save one contact sheet of all rules instead.')
+parser.add_argument('--dedupe', dest='dedupe', action='store_true', \
+	help='With --headless, only simulate one rule of each class of rules \
+	equal up to mirroring and recoloring, and transform its diagram into \
+	the others.')
+parser.add_argument('--daemon', dest='daemon', action='store_true', \
+	help='Serve headless jobs (-o, --outdir, --batch, --headless) of other \
+	runner.py calls over the --socket, keeping modules and caches warm.')
+parser.add_argument('--socket', dest='socket', default=os.environ.get(\
+	'RUNNER_SOCKET', os.path.join(tempfile.gettempdir(), \
+	'runner-{}.sock'.format(os.getuid()))), help='Unix socket of the daemon. \
+	Headless jobs are sent to it when it is running, and run in this \
+	process otherwise.')
+parser.add_argument('--no-daemon', dest='no_daemon', action='store_true', \
+	help='Run in this process even if a daemon is running.')
+parser.add_argument('--profile', dest='profile', nargs='?', const='', \
+	help='Print the time spent in each stage (rule building, stepping, \
+	rewriting, drawing...) on exit, and write cProfile stats to the given \
+	file, if any.')
+
+def finish(drawer, output):
+	""" Draws in a turtle window, or renders to output if given. """
+	if output is None:
+		drawer.draw()
 	else:
-		args.cmap = eval(args.cmap).mpl_colormap
+		drawer.save(output)
 
-if args.fromfile:
-	assert(args.lname[0].endswith('.py'))
-	exec('from {} import *'.format(args.lname[0].split('.py')[0]))
+def ranges(values, option):
+	""" Integers of the values and ranges given to option. """
+	from batch import parse_ranges
 	try:
-		if 'cmap' not in kwargs: kwargs['cmap'] = args.cmap
-		if 'pensize' not in kwargs: kwargs['pensize'] = args.pensize
-	except:
-		kwargs = {'cmap': args.cmap, 'pensize': args.pensize}
-	finally:
-		Drawer(seq, draw_rules, **kwargs).draw()
-else:
-	if args.lname == ['plant']:
-		if args.niter is None:
-			args.niter = 3	
-		plant_rules = {'X': 'F-[[X]+X]+F[+FX]-X', 'F': 'FF'}
-		seq = eval_rules(plant_rules, niter=args.niter, init='X')
-		draw_rules = {'F': lambda t, step: t.forward(step), 
-			'-': lambda t, step: t.left(25), 
-			'+': lambda t, step: t.right(25)}
-		Drawer(seq, draw_rules, cmap=args.cmap, pensize=args.pensize).draw()
-	elif args.lname == ['pythag']:
-		if args.niter is None:
-			args.niter = 5
-		pythag_rules = {'1': '11', '0': '1[0]0'}
-		seq = eval_rules(pythag_rules, niter=args.niter, init='0')
-		draw_rules = {'1': lambda t, step: t.forward(step), 
-			'[': lambda t, step: t.left(45), ']': lambda t, step: t.right(45), 
-			'0': lambda t, step: t.forward(step/2)}
-		Drawer(seq, draw_rules, cmap=args.cmap, pensize=args.pensize).draw()
-	elif args.lname == ['koch']:
-		if args.niter is None:
-			args.niter = 3
-		koch_rules = {'F': 'F+F-F-F+F'}
-		seq = eval_rules(koch_rules, niter=args.niter, init='F')
-		draw_rules = {'F': lambda t, step: t.forward(step),
-			'-': lambda t, step: t.right(90),
-			'+': lambda t, step: t.left(90)}
-		koch_len = 3**(args.niter - 1)
-		Drawer(seq, draw_rules, cmap=args.cmap, pensize=args.pensize, init_angle=0).draw()
-	elif args.lname == ['dragon']:
-		if args.niter is None:
-			args.niter = 6
-		dragon_rules = {'X': 'X+YF+', 'Y': '-FX-Y'}
-		seq = eval_rules(dragon_rules, niter=args.niter, init='FX')
-		draw_rules = {'F': lambda t, step: t.forward(step), 
-			'+': lambda t, step: t.right(90), '-': lambda t, step: t.left(90), 
-			'X': (), 'Y': ()}
-		Drawer(seq, draw_rules, cmap=args.cmap, pensize=args.pensize).draw()
-	elif args.lname == ['sierp']:
-		if args.niter is None:
-			args.niter = 4
-		sierpinski_rules = {'A': 'B-A-B', 'B': 'A+B+A'}
-		seq = eval_rules(sierpinski_rules, niter=args.niter, init='A')
-		draw_rules = {'A': lambda t, step: t.forward(step), 
-			'B': lambda t, step: t.forward(step), 
-			'+': lambda t, step: t.left(60), '-': lambda t, step: t.right(60)}
-		Drawer(seq, draw_rules, cmap=args.cmap, pensize=args.pensize, init_angle=0).draw()
-
-# CA DRAWING
-if args.cname is not None:
-	if args.niter is None: args.niter = 30
+		return parse_ranges(values)
+	except ValueError:
+		parser.error('{} expects numbers or ranges such as 3-6, got {}.'\
+			.format(option, ' '.join(values)))
+
+def single(values, given, option, where='without --outdir or --batch'):
+	""" The only one of the values parsed from the arguments given to option,
+	e.g. outside of --outdir and --batch. """
+	if len(values) != 1:
+		parser.error('{} takes a single value {}, got {}.'.format(option, \
+			where, ' '.join(given)))
+	return values[0]
+
+def draw_lsystems(args):
+	from batch import expand_jobs, load_jobs, lookup_cmap, run_batch, \
+		print_summary
+	cmaps = None
+	if args.cmap is not None:
+		cmaps = args.cmap or ['YlOrRd_9']
+	pensizes = ranges(args.pensize, '-p')
+	niters = ranges(args.niter, '-n') if args.niter is not None else None
+
+	if args.batch is not None or args.outdir is not None:
+		jobs = load_jobs(args.batch) if args.batch is not None else []
+		if args.lname is not None:
+			jobs += expand_jobs({'system': args.lname, 'niter': niters or \
+				[None], 'cmap': cmaps or [None], 'pensize': pensizes})
+		results = run_batch(jobs, args.outdir or '.', \
+			processes=args.processes, force=args.force)
+		print_summary(results)
+		return
+	name = single(args.lname, args.lname, '-l')
+	pensize = single(pensizes, args.pensize, '-p')
+	niter = single(niters, args.niter, '-n') if niters is not None else None
+	cmap = lookup_cmap(single(cmaps, cmaps, '--cmap')) if cmaps else None
+	if args.fromfile:
+		import importlib
+		from lsystem import Drawer
+		assert(name.endswith('.py'))
+		name = name.split('.py')[0]
+		module = importlib.reload(sys.modules[name]) if name in sys.modules \
+			else importlib.import_module(name)
+		kwargs = dict(getattr(module, 'kwargs', {}))
+		kwargs.setdefault('cmap', cmap)
+		kwargs.setdefault('pensize', pensize)
+		finish(Drawer(module.seq, module.draw_rules, **kwargs), args.output)
+	else:
+		from lsystem import SYSTEMS, Derivation, Drawer
+		system = SYSTEMS[name]
+		if niter is None:
+			niter = system['niter']
+		seq = Derivation(system['rules'], niter=niter, init=system['init'])
+		finish(Drawer(seq, system['draw_rules'], cmap=cmap, \
+			pensize=pensize, init_angle=system['init_angle']), args.output)
+
+def draw_automata(args):
+	from batch import parse_ranges
+	from sweep import make_init, sweep
+	niter = 30
+	if args.niter is not None:
+		niter = single(ranges(args.niter, '-n'), args.niter, '-n', \
+			'for automata')
 	try:
-		rule_groups = [[int(c) for c in x.split('-')] for x in args.cname]
+		indices = parse_ranges(args.cname)
 	except ValueError:
 		print('Must input rule indices, e.g. -c 100 102 120-130.')
-		exit()
-	rules = []
-	for rg in rule_groups:
-		if len(rg) == 2:
-			rules += [Rule(i, base=args.base) for i in range(rg[0], rg[1])]
-		else:
-			rules.append(Rule(rg[0], base=args.base))
-	if args.init is not None:
-		init = [int(c) for c in args.init]
+		sys.exit()
+	init = make_init(args.init, niter, base=args.base)
+	if args.headless is not None:
+		sweep(indices, init, niter, args.headless, base=args.base, \
+			sheet=args.sheet, processes=args.processes, dedupe=args.dedupe)
 	else:
-		init = [1 if i == args.niter else 0 for i in range(2*args.niter)]
-	plot_rules(init, rules, args.niter)
+		from automaton import plot_rules, Rule
+		plot_rules(init, [Rule(i, base=args.base) for i in indices], niter)
 
+def run(args):
+	if args.lname is not None or args.batch is not None or \
+			args.outdir is not None:
+		draw_lsystems(args)
+	if args.cname is not None:
+		draw_automata(args)
+
+def is_headless(args):
+	""" Whether the job opens no window, so a daemon can run it. """
+	batch = args.outdir is not None or args.batch is not None
+	lsystems = args.lname is not None or batch
+	automata = args.cname is not None
+	return (lsystems or automata) and \
+		(not lsystems or batch or args.output is not None) and \
+		(not automata or args.headless is not None)
+
+def loaded_sources():
+	""" Digests of the source files of this repository's loaded modules. """
+	here = os.path.dirname(os.path.abspath(__file__))
+	digests = {}
+	for module in list(sys.modules.values()):
+		path = getattr(module, '__file__', None)
+		if path and os.path.dirname(os.path.abspath(path)) == here:
+			with open(path, 'rb') as f:
+				digests[path] = hashlib.sha256(f.read()).hexdigest()
+	return digests
+
+class _Handler(socketserver.StreamRequestHandler):
+	def handle(self):
+		request = json.loads(self.rfile.readline().decode())
+		sources = self.server.sources
+		current = loaded_sources()
+		if any(current.get(path) != digest for path, digest in \
+				sources.items()):
+			# the loaded code (and that of the pool workers forked from it)
+			# is stale: let the client run the job and restart
+			print('runner daemon sources changed, restarting', \
+				file=sys.stderr)
+			self.wfile.write(json.dumps({'stale': True}).encode() + b'\n')
+			self.server.restart = True
+			return
+		out, err, status = io.StringIO(), io.StringIO(), 0
+		cwd = os.getcwd()
+		try:
+			os.chdir(request['cwd'])
+			with redirect_stdout(out), redirect_stderr(err):
+				run(parser.parse_args(request['argv']))
+		except SystemExit as e:
+			status = e.code if isinstance(e.code, int) else int(e.code is not None)
+		except Exception as e:
+			print('{}: {}'.format(type(e).__name__, e), file=err)
+			status = 1
+		finally:
+			os.chdir(cwd)
+		for path, digest in loaded_sources().items():
+			sources.setdefault(path, digest)    # modules imported by the job
+		self.wfile.write(json.dumps({'status': status, 'stdout': \
+			out.getvalue(), 'stderr': err.getvalue()}).encode() + b'\n')
+
+def serve(path):
+	""" Runs the jobs sent to the Unix socket path one at a time, in this
+	process, until interrupted or terminated. When the source of a loaded
+	module changes, the job is handed back to its client and the daemon
+	restarts with the new code. """
+	import signal
+	import matplotlib
+	matplotlib.use('Agg')
+	import automaton, lsystem, geometry, batch, sweep   # warm up
+	if os.path.exists(path):
+		os.remove(path)
+	signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+	with socketserver.UnixStreamServer(path, _Handler) as server:
+		server.sources, server.restart = loaded_sources(), False
+		print('runner daemon listening on {}'.format(path), file=sys.stderr)
+		try:
+			while not server.restart:
+				server.handle_request()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			os.remove(path)
+	if server.restart:
+		os.execv(sys.executable, [sys.executable, os.path.abspath(__file__), \
+			'--daemon', '--socket', path])
+
+def request(path, argv):
+	""" Runs argv on the daemon at path, printing its output, and returns
+	its exit status, or None if no daemon answers or its code is stale. """
+	try:
+		client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		client.connect(path)
+	except OSError:
+		return None
+	with client, client.makefile('rwb') as f:
+		f.write(json.dumps({'argv': argv, 'cwd': os.getcwd()}).encode() + \
+			b'\n')
+		f.flush()
+		reply = f.readline()
+	if not reply:
+		return None
+	reply = json.loads(reply.decode())
+	if reply.get('stale'):
+		return None
+	sys.stdout.write(reply['stdout'])
+	sys.stderr.write(reply['stderr'])
+	return reply['status']
 
+def main(argv=None):
+	argv = sys.argv[1:] if argv is None else argv
+	if not argv:
+		parser.print_help()
+		sys.exit(1)
+	args = parser.parse_args(argv)
+	if args.daemon:
+		serve(args.socket)
+		return
+	if not args.no_daemon and args.profile is None and is_headless(args) \
+			and os.path.exists(args.socket):
+		status = request(args.socket, argv)
+		if status is not None:
+			sys.exit(status)
+	if args.profile is not None:
+		from profiling import Profile
+		atexit.register(Profile(dump=args.profile or None).start().stop)
+	run(args)
 
 
+if __name__ == '__main__':
+	main()
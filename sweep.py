@@ -0,0 +1,195 @@
+"""Sweeps of 1D rules over ranges of indices. The spacetime diagrams of all
+rules are simulated across a pool of processes, which write them straight
+into one shared memory buffer instead of pickling them back, and are then
+saved as one image per rule or as a tiled contact sheet, without a display."""
+
+import os
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from automaton import Rule, find_factorization, paginate, generations, \
+    evolve_elementary
+from symmetry import IDENTITY, canonical, source, transform_cells
+
+def make_init(spec, niter, base=2):
+    """Initial state given by spec: None for 2*niter cells with a 1 in the
+    center (as in runner.py), a string of digits such as '0001000', or
+    'random' / 'random:SEED' for 2*niter random cells."""
+    if spec is None:
+        return np.array([1 if i == niter else 0 for i in range(2*niter)], \
+            dtype=np.uint8)
+    if spec.startswith('random'):
+        seed = int(spec.split(':')[1]) if ':' in spec else None
+        return np.random.RandomState(seed).randint(base, size=2*niter)\
+            .astype(np.uint8)
+    return np.array([int(c) for c in spec], dtype=np.uint8)
+
+_shared = {}
+
+def _attach(name, shape):
+    """Pool initializer mapping the sweep's buffer into the worker."""
+    memory = shared_memory.SharedMemory(name=name)
+    _shared['memory'] = memory
+    _shared['diagrams'] = np.ndarray(shape, dtype=np.uint8, \
+        buffer=memory.buf)
+
+def _simulate(task):
+    """Simulate a chunk of runs (index, init, pad, targets) and write each
+    run's diagram, transformed, into its target (slot, transform)s."""
+    runs, niter, base, size, wrap = task
+    diagrams = _shared['diagrams']
+    groups = {}
+    for run in runs:
+        groups.setdefault((run[1].tobytes(), run[2]), []).append(run)
+    for group in groups.values():
+        init, pad = group[0][1], group[0][2]
+        if base == 2 and size == 3 and pad == 0 and not wrap:
+            cells = evolve_elementary(init, [run[0] for run in group], niter)
+        else:
+            cells = (np.array(list(generations(init, Rule(run[0], base, \
+                size), niter, pad=pad, wrap=wrap))) for run in group)
+        for run, diagram in zip(group, cells):
+            for slot, transform in run[3]:
+                diagrams[slot] = transform_cells(diagram, transform)
+    return len(runs)
+
+class Sweep(object):
+    """Diagrams of the rules indices (of base and size) run from init for
+    niter iterations, in a shared memory array of shape (len(indices),
+    niter + 1, len(init)). Call run() to fill it, and close() (or use as a
+    context manager) to release it. If dedupe, only the representatives of
+    the symmetry classes of the rules (see symmetry.py) are simulated, each
+    once per distinct transformed init and pad its members need, and the
+    other diagrams are mirrored and recolored from theirs."""
+    def __init__(self, indices, init, niter, base=2, size=3, pad=0, \
+            wrap=False, dedupe=False):
+        self.indices = list(indices)
+        self.init = np.asarray(init, dtype=np.uint8)
+        self.niter, self.base, self.size = niter, base, size
+        self.pad, self.wrap = pad, wrap
+        self.runs = self.plan(dedupe)
+        self.shape = (len(self.indices), niter + 1, len(self.init))
+        self.memory = shared_memory.SharedMemory(create=True, \
+            size=max(1, int(np.prod(self.shape))))
+        self.diagrams = np.ndarray(self.shape, dtype=np.uint8, \
+            buffer=self.memory.buf)
+
+    def plan(self, dedupe):
+        """List of the runs (index, init, pad, targets) to simulate, where
+        targets lists the (slot, transform) of each diagram made from it."""
+        if not dedupe:
+            return [(index, self.init, self.pad, [(slot, IDENTITY)]) for \
+                slot, index in enumerate(self.indices)]
+        runs = {}
+        for slot, index in enumerate(self.indices):
+            representative, g = canonical(index, self.base, self.size)
+            init, pad = source(self.init, self.pad, g)
+            key = (representative, init.tobytes(), pad)
+            if key not in runs:
+                runs[key] = (representative, init, pad, [])
+            runs[key][3].append((slot, g))
+        return list(runs.values())
+
+    def tasks(self, chunksize):
+        for start in range(0, len(self.runs), chunksize):
+            yield (self.runs[start:start + chunksize], self.niter, self.base, \
+                self.size, self.wrap)
+
+    def run(self, processes=None, chunksize=None):
+        """Simulate all runs across a pool of processes (all cpus but one
+        by default), chunksize runs per task. Returns self."""
+        if processes is None:
+            processes = max(1, mp.cpu_count() - 1)
+        if chunksize is None:
+            chunksize = max(1, -(-len(self.runs)//(4*processes)))
+        tasks = self.tasks(chunksize)
+        if processes == 1:
+            _shared['diagrams'] = self.diagrams
+            try:
+                for task in tasks:
+                    _simulate(task)
+            finally:
+                del _shared['diagrams']
+            return self
+        with mp.Pool(processes, initializer=_attach, \
+                initargs=(self.memory.name, self.shape)) as pool:
+            for _ in pool.imap_unordered(_simulate, tasks):
+                pass
+        return self
+
+    def save_images(self, outdir, cmap='Greys', format='png'):
+        """Save each rule's diagram to outdir as rule-INDEX.format, one pixel
+        per cell. Returns the list of paths."""
+        os.makedirs(outdir, exist_ok=True)
+        paths = []
+        for index, diagram in zip(self.indices, self.diagrams):
+            path = os.path.join(outdir, 'rule-{}.{}'.format(index, format))
+            save_image(path, diagram, self.base, cmap)
+            paths.append(path)
+        return paths
+
+    def contact_sheet(self, columns=None, gap=2, start=0, stop=None):
+        """The diagrams start to stop tiled in one array, in rows of columns
+        diagrams (laid out by find_factorization by default) separated by gap
+        cells of -1."""
+        diagrams = self.diagrams[start:stop]
+        n, height, width = diagrams.shape
+        if columns is None:
+            rows, columns = find_factorization(n)
+        rows = -(-n//columns)
+        sheet = np.full((rows*(height + gap) - gap, \
+            columns*(width + gap) - gap), -1, dtype=np.int16)
+        for k, diagram in enumerate(diagrams):
+            y, x = (k//columns)*(height + gap), (k % columns)*(width + gap)
+            sheet[y:y + height, x:x + width] = diagram
+        return sheet
+
+    def save_sheet(self, path, cmap='Greys', columns=None, gap=2, \
+            max_pixels=2**24):
+        """Save contact_sheet() to path, gaps drawn white. Rules that do not
+        fit in max_pixels go to further sheets, numbered path-2.png and so
+        on. Returns the list of paths."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        n, height, width = self.shape
+        per_sheet = max(1, max_pixels//((height + gap)*(width + gap)))
+        root, ext = os.path.splitext(path)
+        paths = []
+        for k, (start, stop, (_, m)) in enumerate(paginate(n, per_sheet)):
+            paths.append(path if k == 0 else '{}-{}{}'.format(root, k + 1, \
+                ext))
+            save_image(paths[-1], self.contact_sheet(columns or m, gap, \
+                start, stop), self.base, cmap)
+        return paths
+
+    def close(self):
+        self.diagrams = None
+        self.memory.close()
+        self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def save_image(path, cells, base, cmap='Greys'):
+    """Save cells (values below 0 drawn white) as an image with one pixel per
+    cell, colored by the matplotlib colormap cmap over 0 to base - 1."""
+    import matplotlib
+    from matplotlib.image import imsave
+    colors = matplotlib.colormaps[cmap](np.asarray(cells)/max(1, base - 1), \
+        bytes=True)
+    colors[np.asarray(cells) < 0] = 255
+    imsave(path, colors)
+
+def sweep(indices, init, niter, outdir, base=2, size=3, pad=0, wrap=False, \
+        sheet=False, cmap='Greys', processes=None, chunksize=None, \
+        dedupe=False):
+    """Simulate the rules indices and save their diagrams to outdir, as one
+    image per rule, or contact sheets outdir/sheet.png (and sheet-2.png and
+    so on for many rules) if sheet. Returns the list of saved paths."""
+    with Sweep(indices, init, niter, base, size, pad, wrap, dedupe) as s:
+        s.run(processes, chunksize)
+        if sheet:
+            return s.save_sheet(os.path.join(outdir, 'sheet.png'), cmap)
+        return s.save_images(outdir, cmap)
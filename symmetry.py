@@ -0,0 +1,91 @@
+"""Symmetry classes of 1D rules. Mirroring space and permuting the colors
+(complementing, for base 2) map the spacetime diagrams of a rule onto those
+of another rule, so of all the rules related this way only one, the class
+representative, needs simulating. Elementary rules fall into 88 classes.
+
+A transform is a pair (mirror, perm) acting on states x as
+(g x)[i] = perm[x[mirror(i)]]; the rule g r steps g x to g of r's step of x.
+So the diagram of g r from init, with the boundary padded by pad, is g
+applied to the diagram of r from g^-1 init, padded by perm^-1[pad].
+
+Mirroring only maps diagrams onto diagrams when the neighborhood is centered
+on its cell, i.e. for odd sizes; for even sizes only colors are permuted."""
+
+from functools import lru_cache
+from itertools import permutations
+import numpy as np
+from automaton import rule_table, dec2base
+
+IDENTITY = (False, None)
+
+def transforms(base=2, size=3):
+    """All transforms (mirror, perm) of base colors and neighborhoods of
+    size, identity first. Only odd sizes are mirrored."""
+    mirrors = (False, True) if size % 2 else (False,)
+    return [(mirror, perm) for mirror in mirrors for perm in \
+        permutations(range(base))]
+
+def inverse(transform):
+    mirror, perm = transform
+    return mirror, None if perm is None else tuple(np.argsort(perm).tolist())
+
+@lru_cache(maxsize=None)
+def _digits(base, size):
+    return np.array([dec2base(k, base, width=size) for k in \
+        range(base**size)], dtype=np.intp)
+
+def _encode(digits, base):
+    codes = np.zeros(len(digits), dtype=np.intp)
+    for column in digits.T:
+        codes = codes*base + column
+    return codes
+
+def transform_rule(index, transform, base=2, size=3):
+    """Index of the rule g r for the rule index r and the transform g."""
+    mirror, perm = transform
+    if mirror and size % 2 == 0:
+        raise ValueError('Rules of even size {} cannot be mirrored.'\
+            .format(size))
+    perm = np.arange(base) if perm is None else np.asarray(perm)
+    digits = _digits(base, size)
+    source = np.argsort(perm)[digits[:, ::-1] if mirror else digits]
+    table = perm[rule_table(index, base, size)[_encode(source, base)]]
+    index = 0
+    for t in reversed(table.tolist()):
+        index = index*base + t
+    return index
+
+@lru_cache(maxsize=2**16)
+def canonical(index, base=2, size=3):
+    """Return (representative, transform): the least rule index of the
+    symmetry class of index, and the transform g mapping it back, i.e.
+    transform_rule(representative, g) == index."""
+    best = min((transform_rule(index, g, base, size), g) for g in \
+        transforms(base, size))
+    return best[0], inverse(best[1])
+
+def symmetry_classes(indices, base=2, size=3):
+    """Dictionary from the representatives of the rules indices to the lists
+    of (index, transform) of the rules indices they represent."""
+    classes = {}
+    for index in indices:
+        representative, g = canonical(index, base, size)
+        classes.setdefault(representative, []).append((index, g))
+    return classes
+
+def transform_cells(cells, transform):
+    """Apply the transform to states or diagrams cells, space being their
+    last axis."""
+    mirror, perm = transform
+    cells = np.asarray(cells)
+    if mirror:
+        cells = cells[..., ::-1]
+    if perm is not None and list(perm) != sorted(perm):
+        cells = np.asarray(perm, dtype=cells.dtype)[cells]
+    return cells
+
+def source(init, pad, transform):
+    """The init and pad whose diagram under a representative transforms to
+    that of init and pad, see the module docstring."""
+    g = inverse(transform)
+    return transform_cells(init, g), pad if g[1] is None else g[1][pad]
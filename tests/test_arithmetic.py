@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from arithmetic import get_graph, poly_map, components, batch_ncomponents, \
+    ncomponents_reference, coef_chunks, primes_in_range, iter_primes, \
+    primesfrom2to
+
+def brute_force(graph):
+    """Cycle lengths (sorted) and tail lengths of graph by walking from every
+    node."""
+    p = len(graph)
+    cycles, tails = set(), []
+    for x in range(p):
+        path = {}
+        while x not in path:
+            path[x] = len(path)
+            x = graph[x]
+        cycles.add(frozenset(y for y, k in path.items() if k >= path[x]))
+    on_cycle = set().union(*cycles)
+    for x in range(p):
+        steps = 0
+        while x not in on_cycle:
+            x, steps = graph[x], steps + 1
+        tails.append(steps)
+    return sorted(len(c) for c in cycles), tails
+
+@pytest.mark.parametrize('p', [2, 3, 5, 7, 11, 13])
+def test_components_match_reference(p):
+    for coefs in coef_chunks(p, 2, p**3):
+        succs = poly_map(coefs, p)
+        counts = batch_ncomponents(succs)
+        for c, succ, count in zip(coefs, succs, counts):
+            graph = get_graph(lambda x: c[0] + c[1]*x + c[2]*x**2, p)
+            assert succ.tolist() == [graph[x] for x in range(p)]
+            n, cycle_lengths, tails = components(graph)
+            expected_cycles, expected_tails = brute_force(graph)
+            assert n == count == ncomponents_reference(graph) == \
+                len(expected_cycles)
+            assert sorted(cycle_lengths.tolist()) == expected_cycles
+            assert tails.tolist() == expected_tails
+
+def sieve(n):
+    is_prime = np.ones(n, dtype=bool)
+    is_prime[:2] = False
+    for k in range(2, int(n**0.5) + 1):
+        if is_prime[k]:
+            is_prime[k*k::k] = False
+    return np.flatnonzero(is_prime)
+
+def test_primes_match_plain_sieve():
+    expected = sieve(3*10**6)
+    assert (primesfrom2to(3*10**6) == expected).all()
+    for lo, hi in ((0, 10), (2, 3), (1000, 1000), (999983, 2**21 + 17), \
+            (2**20 - 5, 2**20 + 5), (17, 3*10**6)):
+        assert primes_in_range(lo, hi).tolist() == \
+            expected[(expected >= lo) & (expected < hi)].tolist()
+    assert np.concatenate(list(iter_primes(2**20 - 100, 2**20 + 100)))\
+        .tolist() == primes_in_range(2**20 - 100, 2**20 + 100).tolist()
+    stream = iter_primes(100)
+    assert next(stream).tolist() == expected[(expected >= 100) & \
+        (expected < 2**20)].tolist()
+    assert next(stream).tolist() == expected[(expected >= 2**20) & \
+        (expected < 2**21)].tolist()
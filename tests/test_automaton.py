@@ -0,0 +1,133 @@
+import random
+from itertools import count
+import numpy as np
+import pytest
+from automaton import Rule, next_state, neighborhoods, dec2base, generations, \
+    evolve_elementary, Prefetcher, animate_rules, next_state_nD, nball, \
+    wrapped_ball, TotalisticRule, OuterTotalisticRule, SparseAutomaton
+
+def reference_next_state(state, index, base, size, pad=0):
+    """next_state as a per-cell lookup in the rule's dictionary, as Rule
+    was originally defined."""
+    targets = dec2base(index, base, width=base**size)
+    table = {dec2base(i, base, width=size): t for i, t in \
+        enumerate(reversed(targets))}
+    return [table[tuple(n)] for n in neighborhoods(list(state), size, pad)]
+
+@pytest.mark.parametrize('base, size', [(2, 1), (2, 2), (2, 3), (3, 3), \
+    (2, 5), (4, 3), (3, 4)])
+@pytest.mark.parametrize('pad', [0, 1])
+def test_next_state_matches_dict_lookup(base, size, pad):
+    rng = random.Random(base*size)
+    indices = [0, base**base**size - 1] + [rng.randrange(base**base**size) \
+        for _ in range(20)]
+    state = np.random.RandomState(size).randint(base, size=50)
+    for index in indices:
+        assert next_state(state, Rule(index, base, size), pad=pad).tolist() \
+            == reference_next_state(state, index, base, size, pad)
+
+def test_random_rule_index_round_trips():
+    np.random.seed(0)
+    for base, size in ((2, 3), (3, 3), (2, 5)):
+        rule = Rule('random', base, size)
+        assert (Rule(rule.index, base, size).table == rule.table).all()
+
+@pytest.mark.parametrize('width', [1, 2, 5, 63, 64, 65, 149])
+@pytest.mark.parametrize('wrap', [False, True])
+def test_evolve_elementary_matches_generations(width, wrap):
+    init = np.random.RandomState(width).randint(2, size=width)
+    cells = evolve_elementary(init, range(256), 20, wrap=wrap)
+    for index in range(256):
+        assert (cells[index] == np.array(list(generations(init, \
+            Rule(index), 20, wrap=wrap)))).all(), index
+
+def test_closed_prefetcher_does_not_hang():
+    prefetcher = Prefetcher(count(), depth=4)
+    assert [next(prefetcher) for _ in range(10)] == list(range(10))
+    prefetcher.close()
+    assert len(list(prefetcher)) <= 5
+
+def test_animation_frames_after_show_returns():
+    import matplotlib.pyplot as plt
+    plt.ion()
+    try:
+        init = np.zeros(50, dtype=np.uint8)
+        init[25] = 1
+        rules = [Rule(30), Rule(90)]
+        ani = animate_rules(init, rules, 40, buffer=8)
+        for i in range(40):
+            ani._func(i)
+        for rule, ax in zip(rules, ani._fig.axes):
+            assert (ax.images[0].get_array() == np.array(list(generations(\
+                init, rule, 40)))).all()
+        plt.close('all')
+    finally:
+        plt.ioff()
+
+def reference_next_state_nD(A, rule, reach=1, wrap=True, pad=0):
+    """next_state_nD cell by cell from the boxes of nball()."""
+    out = np.empty_like(A)
+    for x in np.ndindex(*A.shape):
+        out[x] = rule[nball(A, x, reach=reach, wrap=wrap, pad=pad)]
+    return out
+
+@pytest.mark.parametrize('shape, reach, rule', [((17,), 1, Rule(110)), \
+    ((23,), 2, Rule(2**31 + 12345, 2, 5)), ((9, 11), 1, Rule(3**300 % \
+    2**512, 2, 9)), ((7, 8), 1, Rule(5**200 % 3**3**9, 3, 9))])
+@pytest.mark.parametrize('wrap, pad', [(True, 0), (False, 0), (False, 1)])
+def test_next_state_nD_matches_nball(shape, reach, rule, wrap, pad):
+    A = np.random.RandomState(len(shape)).randint(rule.base, size=shape)
+    for _ in range(3):
+        expected = reference_next_state_nD(A, rule, reach, wrap, pad)
+        A = next_state_nD(A, rule, reach=reach, wrap=wrap, pad=pad)
+        assert (A == expected).all()
+
+def test_wrapped_ball_matches_nball():
+    A = np.arange(30).reshape(5, 6)
+    for x in np.ndindex(*A.shape):
+        assert (wrapped_ball(A, x, 1) == nball(A, x, 1).ravel()).all()
+
+def decode(code, base, size):
+    return dec2base(code, base, width=size)
+
+@pytest.mark.parametrize('rule', [TotalisticRule(1599, 3), \
+    TotalisticRule(20, 2, 5), TotalisticRule(7**20 % 3**19, 3, 9), \
+    OuterTotalisticRule('B3/S23'), OuterTotalisticRule('B36/S125')])
+def test_totalistic_tables_match_getitem(rule):
+    for code in range(rule.base**rule.size):
+        assert rule.table[code] == rule[decode(code, rule.base, rule.size)]
+
+def run_sparse(init, rule, niter, **kwargs):
+    sparse = SparseAutomaton(init, rule, **kwargs)
+    tile = kwargs.pop('tile')
+    A = np.asarray(init)
+    for _ in range(niter):
+        A = next_state_nD(A, rule, **kwargs)
+        assert (sparse.step() == A).all()
+    return sparse
+
+@pytest.mark.parametrize('shape, tile', [((32, 32), 8), ((30, 27), 8), \
+    ((33, 9), 16), ((17, 17), 4)])
+@pytest.mark.parametrize('wrap, pad', [(True, 0), (False, 0), (False, 1)])
+def test_sparse_life_matches_next_state_nD(shape, tile, wrap, pad):
+    life = OuterTotalisticRule('B3/S23')
+    init = np.zeros(shape, dtype=int)
+    init[1:4, 1:4] = [[0, 1, 0], [0, 0, 1], [1, 1, 1]]      # a glider
+    init[-5:, -5:] = np.random.RandomState(0).randint(2, size=(5, 5))
+    run_sparse(init, life, 40, wrap=wrap, pad=pad, tile=tile)
+
+@pytest.mark.parametrize('width, tile, reach', [(9, 4, 2), (10, 4, 3), \
+    (64, 16, 1), (37, 8, 2)])
+@pytest.mark.parametrize('wrap', [True, False])
+def test_sparse_1D_matches_next_state_nD(width, tile, reach, wrap):
+    # widths whose last tile is shorter than reach need a spread of 2 tiles
+    rule = TotalisticRule(22 if reach > 1 else 6, 2, 2*reach + 1)
+    init = np.zeros(width, dtype=int)
+    init[0] = init[width//2] = 1
+    run_sparse(init, rule, 30, reach=reach, wrap=wrap, tile=tile)
+
+def test_sparse_skips_quiescent_tiles():
+    init = np.zeros((64, 64), dtype=int)
+    init[1:4, 1:4] = [[0, 1, 0], [0, 0, 1], [1, 1, 1]]
+    sparse = run_sparse(init, OuterTotalisticRule('B3/S23'), 10, tile=8)
+    assert sparse.evaluated < init.size//4
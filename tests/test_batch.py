@@ -0,0 +1,25 @@
+import os
+import shutil
+from batch import expand_jobs, run_batch, output_name
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def test_seeded_system_files_render_independently_of_order(tmp_path):
+    system = str(tmp_path/'mysys.py')   # outside the repository
+    shutil.copy(os.path.join(HERE, 'test2.py'), system)
+    alone = expand_jobs({'system': system, 'seed': 2, 'size': 1})
+    both = expand_jobs({'system': system, 'seed': [1, 2], 'size': 1})
+    run_batch(alone, str(tmp_path/'alone'), processes=1)
+    run_batch(both, str(tmp_path/'both'), processes=1)
+    name = output_name(alone[0])
+    assert read(tmp_path/'alone'/name) == read(tmp_path/'both'/name)
+
+def test_unchanged_jobs_are_cached(tmp_path):
+    jobs = expand_jobs({'system': 'koch', 'niter': 2, 'size': 1})
+    assert [s for _, s, _ in run_batch(jobs, str(tmp_path), 1)] == \
+        ['rendered']
+    assert [s for _, s, _ in run_batch(jobs, str(tmp_path), 1)] == ['cached']
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+from automaton import Rule
+from classify import label, label_elementary, random_init, is_rotation, \
+    shift_period, find_cycle
+
+@pytest.mark.parametrize('width, niter', [(5, 40), (31, 200), (64, 300), \
+    (65, 300), (149, 500)])
+def test_batched_labels_match_single_rule_labels(width, niter):
+    init = random_init(width, seed=width)
+    batched = label_elementary(init, list(range(256)), niter)
+    for index, labelled in zip(range(256), batched):
+        assert tuple(labelled) == tuple(label(init, Rule(index), niter)), \
+            index
+
+def test_is_rotation():
+    a = np.array([0, 1, 1, 0, 1, 0, 0])
+    for k in range(len(a)):
+        assert is_rotation(a, np.roll(a, k))
+    assert not is_rotation(a, a[::-1])
+    assert not is_rotation(a, np.array([1, 1, 1, 0, 1, 0, 0]))
+
+def test_shift_period_of_a_glider():
+    init = np.zeros(40, dtype=np.uint8)
+    init[:3] = 1
+    transient, period, history = find_cycle(init, Rule(184), 500)
+    assert shift_period(history, transient, period) == 1
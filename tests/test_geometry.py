@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from lsystem import SYSTEMS, eval_rules, iter_rules
+from geometry import GeometryCache, trace, trace_derivation
+
+@pytest.mark.parametrize('name', sorted(SYSTEMS))
+def test_memoized_trace_matches_trace(name):
+    system = SYSTEMS[name]
+    cache = GeometryCache()
+    for niter in range(system['niter'] + 3):
+        expected, n = trace(eval_rules(system['rules'], niter, \
+            system['init']), system['draw_rules'], \
+            init_angle=system['init_angle'])
+        segments, m = trace_derivation(system['rules'], niter, \
+            system['init'], system['draw_rules'], \
+            init_angle=system['init_angle'], cache=cache)
+        assert m == n
+        assert segments.shape == expected.shape
+        assert np.allclose(segments, expected, atol=1e-7)
+
+def test_random_rules_fall_back_to_trace():
+    rules = {'F': lambda: 'F+F' if np.random.rand() < 0.5 else 'F-F'}
+    draw_rules = SYSTEMS['koch']['draw_rules']
+    np.random.seed(0)
+    expected = trace(iter_rules(rules, 5, 'F'), draw_rules)
+    np.random.seed(0)
+    segments, n = trace_derivation(rules, 5, 'F', draw_rules)
+    assert n == expected[1] and np.allclose(segments, expected[0])
+
+def test_cache_shared_by_different_rules():
+    draw_rules = SYSTEMS['koch']['draw_rules']
+    cache = GeometryCache()
+    def check(rule):
+        rules = {'F': rule}     # freed on return, so its id gets reused
+        expected = trace(eval_rules(rules, 3, 'F'), draw_rules)
+        segments, n = trace_derivation(rules, 3, 'F', draw_rules, \
+            cache=cache)
+        assert n == expected[1] and segments.shape == expected[0].shape
+        assert np.allclose(segments, expected[0])
+    for rule in ('F+F-F', 'F-F+F', 'FF+F', 'F+F-F'):
+        check(rule)
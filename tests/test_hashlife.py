@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from automaton import OuterTotalisticRule, Rule, next_state_nD
+from hashlife import HashLife
+
+def direct(init, rule, niter, margin):
+    """niter generations of init on a grid with margin empty cells around
+    it, wide enough for the pattern never to reach its edge."""
+    cells = np.pad(init, margin)
+    for _ in range(niter):
+        cells = next_state_nD(cells, rule, wrap=False)
+    return cells
+
+@pytest.mark.parametrize('init', [np.zeros((1, 1), dtype=int), \
+    np.array([[0, 1, 1], [1, 1, 0], [0, 1, 0]]), \
+    np.array([[0, 1, 0], [0, 0, 1], [1, 1, 1]]), \
+    np.random.RandomState(0).randint(2, size=(4, 4)), \
+    np.random.RandomState(1).randint(2, size=(13, 9))])
+@pytest.mark.parametrize('niter', [1, 2, 5, 16, 37])
+def test_life_matches_direct_simulation(init, niter):
+    h = HashLife(OuterTotalisticRule('B3/S23'))
+    h.load(init)
+    h.step(niter)
+    margin = niter + 1
+    expected = direct(init, h.rule, niter, margin)
+    lo = (-margin,)*2
+    hi = tuple(n + margin for n in init.shape)
+    assert (h.to_array(lo, hi) == expected).all()
+    assert h.population == expected.sum()
+
+def test_step_right_after_construction():
+    h = HashLife(OuterTotalisticRule('B3/S23'))
+    h.step(1)
+    assert h.population == 0
+
+@pytest.mark.parametrize('index', [30, 90, 110, 150])
+def test_elementary_matches_direct_simulation(index):
+    init = np.array([1, 0, 1, 1])
+    h = HashLife(Rule(index))
+    h.load(init)
+    h.step(21)
+    expected = direct(init, h.rule, 21, 22)
+    assert (h.to_array((-22,), (26,)) == expected).all()
+
+def test_r_pentomino():
+    h = HashLife(OuterTotalisticRule('B3/S23'))
+    h.load(np.array([[0, 1, 1], [1, 1, 0], [0, 1, 0]]))
+    h.step(1103)
+    assert h.population == 116
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+from automaton import Rule, generations
+from history import History, write_history
+
+@pytest.mark.parametrize('base, width, index', [(2, 149, 110), (2, 64, 30), \
+    (3, 37, 12345)])
+def test_windows_match_generations(tmp_path, base, width, index):
+    init = np.random.RandomState(width).randint(base, size=width)
+    rule = Rule(index, base)
+    path = str(tmp_path/'run.cahist')
+    write_history(path, init, rule, 30)
+    expected = np.array(list(generations(init, rule, 30)))
+    history = History(path)
+    assert len(history) == 31
+    for rows in (slice(None), slice(3, 9), 5, -1, [1, 4]):
+        for cols in (slice(None), slice(5, 100), slice(7, 8), slice(9, 3), \
+                slice(None, None, 3), slice(3, 140, 7), \
+                slice(None, None, -1), slice(-20, None), 0, 5, -1, \
+                width - 1, [1, 3, 9]):
+            window = history[rows, cols]
+            assert window.shape == expected[rows][..., cols].shape
+            assert (window == expected[rows][..., cols]).all()
@@ -0,0 +1,36 @@
+import random
+import numpy as np
+import pytest
+from automaton import generations, Rule
+from symmetry import canonical, transform_rule, transforms
+from sweep import Sweep, make_init
+
+@pytest.mark.parametrize('base, size, nrules', [(2, 2, 16), (2, 3, 256), \
+    (2, 4, 66), (3, 2, 200), (3, 3, 200), (4, 3, 100)])
+@pytest.mark.parametrize('pad, wrap', [(0, False), (1, False), (0, True)])
+def test_dedupe_matches_direct_simulation(base, size, nrules, pad, wrap):
+    rng = random.Random(size)
+    indices = [rng.randrange(base**base**size) for _ in range(nrules)] if \
+        nrules < base**base**size else range(nrules)
+    init = make_init('random:1', 12, base)
+    with Sweep(indices, init, 12, base, size, pad, wrap, dedupe=True) as s:
+        s.run(processes=1)
+        for index, diagram in zip(s.indices, s.diagrams):
+            direct = np.array(list(generations(init, Rule(int(index), base, \
+                size), 12, pad=pad, wrap=wrap)))
+            assert (diagram == direct).all(), index
+
+@pytest.mark.parametrize('base, size', [(2, 2), (2, 3), (3, 3), (2, 4)])
+def test_canonical_maps_back(base, size):
+    for index in range(min(base**base**size, 300)):
+        representative, g = canonical(index, base, size)
+        assert representative <= index
+        assert transform_rule(representative, g, base, size) == index
+
+def test_even_sizes_are_not_mirrored():
+    assert all(not mirror for mirror, _ in transforms(2, 4))
+    with pytest.raises(ValueError):
+        transform_rule(4, (True, None), 2, 2)
+
+def test_elementary_classes():
+    assert len({canonical(i)[0] for i in range(256)}) == 88